@@ -0,0 +1,13 @@
+from soas_project.batch import run_sweep
+
+#The sweep runs in worker processes, which import this script again
+# where processes are spawned (macOS and Windows)
+if __name__ == "__main__":
+    results = run_sweep("city_map_21x21.txt",
+                        {"N": [2, 4, 6, 8, 10],
+                         "PassengerPopulation": [.1, .2, .4],
+                         "PassengerPooling": [0, .5, 1]},
+                        steps=200)
+
+    results.to_csv("batch_run.csv", index=False)
+    print(results)
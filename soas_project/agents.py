@@ -1,13 +1,13 @@
 from mesa import Agent
 
-import random
-from itertools import permutations
+import time
+
+from .planning import Plan, insertion_cost, order_stops
 
 class Passenger(Agent):
     def __init__(self, unique_id, model, pos, destination, road_access, isCarPooler):
         super().__init__(unique_id, model)
         self.pos = pos
-        self.time_waiting = 0
         self.destination = destination
         self.isCarPooler = isCarPooler
         self.road_access = road_access
@@ -18,18 +18,38 @@ class Passenger(Agent):
         self.last_step_executed = False
         self.set_to_be_removed = False
 
-        self.distance_travelled = 0
+        #Cab that picked the passenger up and its odometer at the pickup
+        self.cab = None
+        self.pickup_odometer = 0
         self.distance_estimation = 0
 
+        #Last tick completed before the passenger appeared
+        self.created_at = model.time
+
+    @property
+    def time_waiting(self):
+        #Ticks since the passenger appeared, computed on demand so that
+        # ticks skipped by the event engine count as well
+        return self.model.time - self.created_at
+
+    @property
+    def distance_travelled(self):
+        #Road cost driven since the pickup
+        if(self.cab is None):
+            return 0
+
+        return self.cab.odometer - self.pickup_odometer
+
     def auto_remove(self):
         if(self.last_step_executed):
             self.model.schedule.remove(self)
+            self.model.sightings.remove(self)
             self.model.grid.remove_agent(self)
+            self.model.passengers.pop(self)
         else:
             self.set_to_be_removed = True
 
     def step(self):
-        self.time_waiting = self.time_waiting + 1
         self.last_step_executed = True
 
         if(self.set_to_be_removed):
@@ -52,31 +72,6 @@ class Passenger(Agent):
     def stage_4(self):
         pass
 
-class Grass(Agent):
-    def __init__(self, unique_id, model, pos, isBlockCenter):
-        super().__init__(unique_id, model)
-        self.pos = pos
-        self.isBlockCenter = isBlockCenter
-
-    def step(self):
-        pass
-
-    #Stage 1
-    def stage_1(self):
-        pass
-    
-    #Stage 2
-    def stage_2(self):
-        pass
-
-    #Stage 3
-    def stage_3(self):
-        pass
-
-    #Stage 4
-    def stage_4(self):
-        pass
-
 class Cab(Agent):
     def __init__(self, unique_id, model, pos, heading=(1, 0)):
         super().__init__(unique_id, model)
@@ -86,7 +81,16 @@ class Cab(Agent):
         self.destination = pos
         self.passengers = []
         self.car_pooling = False
-        self.sighted_passengers = dict()
+
+        #Cells still to drive of the current path segment
+        self.route_segment = []
+        self.segment_destination = None
+
+        #Road cost driven since the cab was created
+        self.odometer = 0
+
+        #Drop-off plan, made on the first read after the passengers change
+        self._plan = None
 
     @property
     def is_empty(self):
@@ -105,40 +109,40 @@ class Cab(Agent):
         return self.is_empty
 
     @property
-    def has_passenger_assigned(self):
-        for passg in self.sighted_passengers.keys():
-            if (self.sighted_passengers[passg] != None and self.sighted_passengers[passg].unique_id == self.unique_id):
-                return True
+    def plan(self):
+        #Read-only: the plan is rebuilt by replan() when the passengers
+        # change, not edited by the readers
+        if(self._plan is None):
+            assigned = self.passenger_assigned
+            self._plan = Plan(self.pos, [p.destination for p in self.passengers], self.get_distance,
+                              self.odometer, self.model.time, self.model.cab_speed,
+                              via=assigned.road_access if assigned != None else None,
+                              hops=None if self.model.routes.unit_costs else self.get_hops)
 
-        return False
+        return self._plan
 
-    @property
-    def passenger_assigned(self):
-        for passg in self.sighted_passengers.keys():
-            if (self.sighted_passengers[passg] != None and self.sighted_passengers[passg].unique_id == self.unique_id):
-                return passg
-
-        return None
+    def replan(self):
+        self._plan = None
 
     @property
-    def unasigned_passenger(self):
-        unasigned_passengers = [a for a in self.sighted_passengers.keys() if self.sighted_passengers[a] == None]
+    def sighted_passengers(self):
+        #View of the dispatcher's passenger -> cab table, shared by all the cabs
+        return self.model.dispatcher.assignments
 
-        return unasigned_passengers
+    @property
+    def has_passenger_assigned(self):
+        return self in self.model.dispatcher.assigned
 
-    def broadcast_sighted_passengers(self, passengers):
-        for p in passengers:
-            if (p not in self.sighted_passengers):
-                self.sighted_passengers[p] = None
-                p.visualized = True
+    @property
+    def passenger_assigned(self):
+        return self.model.dispatcher.assigned.get(self)
 
-    def remove_pickedup(self, passenger):
-        self.sighted_passengers.pop(passenger)
+    @property
+    def unasigned_passenger(self):
+        return self.model.dispatcher.waiting
 
     def broadcast_pickup(self, passenger):
-        self.sighted_passengers.pop(passenger)
-        for agent in [a for a in self.model.schedule.agents if isinstance(a, Cab) and a.unique_id != self.unique_id]:
-            agent.remove_pickedup(passenger)
+        self.model.dispatcher.pickup(passenger)
 
     #Stage 1
     def stage_1(self):
@@ -146,8 +150,9 @@ class Cab(Agent):
         #drop_passengers
 
         #Check if there are passengers to be
-        # dropped at the current cab's location
-        while(not self.is_empty and self.pos == self.destination):
+        # dropped at the current cab's location. On the way to a pickup
+        # the destination is the pickup, where nobody gets off
+        while(not self.is_empty and self.pos == self.destination == self.passengers[0].destination):
             self.drop_passenger()
 
         #print(f'Leaving stage 1 - {self.unique_id}')
@@ -158,45 +163,55 @@ class Cab(Agent):
         #print('Lookding around')
         passengers = self.get_passengers_around()
 
-        #print('Updating local sighted_list')
-        for p in [pas for pas in passengers if pas not in self.sighted_passengers.keys()]:
-            self.sighted_passengers[p] = None
-
-        if(len(passengers) > 0):
-            #print('Notifying other cabs')
-            for agent in [a for a in self.model.schedule.agents if isinstance(a, Cab) and a.unique_id != self.unique_id]:
-                agent.broadcast_sighted_passengers(passengers)
+        #print('Notifying the dispatcher')
+        for p in passengers:
+            self.model.dispatcher.sight(p)
 
         #print(f'Leaving stage 2 - {self.unique_id}')
     #Stage 3
     def stage_3(self):
         #print(f'Entering stage 3 - {self.unique_id}')
-        #bid_for_passengers
-        if(self.has_free_seats and not self.has_passenger_assigned and len(self.unasigned_passenger) > 0):
+        #bid_for_passengers, only when the model runs an auction this tick
+        if(not self.model.dispatching or not self.has_free_seats or self.has_passenger_assigned):
+            return
+
+        start = time.process_time()
+        if(self.model.bid_candidates > 0):
+            candidates = self.model.nearest_passengers(self, self.model.bid_candidates)
+        else:
+            candidates = self.unasigned_passenger
+
+        if(len(candidates) > 0):
             dist_pass = {}
-            for p in self.unasigned_passenger:
-                distance = self.get_distance(self.pos, p.road_access)
-                
-                if(self.has_free_seats_normal or (p.isCarPooler and self.has_free_seats_car_pooling and distance <= 1)):
-                    dist_pass[p] = distance
-        
+            if(self.model.bid_mode == "insertion" and not self.is_empty):
+                for p in candidates:
+                    if(p.isCarPooler and self.has_free_seats_car_pooling):
+                        cost = self.insertion_bid(p)
+                        if(cost is not None):
+                            dist_pass[p] = cost
+            else:
+                #-1: the cab cannot reach the passenger
+                distances = self.bid_distances(candidates)
+                if(self.has_free_seats_normal):
+                    dist_pass = {p: distance for p, distance in zip(candidates, distances) if distance >= 0}
+                else:
+                    #A pooling cab only takes the carpoolers next to it
+                    dist_pass = {p: distance for p, distance in zip(candidates, distances)
+                                 if p.isCarPooler and 0 <= distance <= 1}
+
             self.model.bid(self, dist_pass)
 
+        self.model.dispatch_cpu_time += time.process_time() - start
+
         #print(f'Leaving stage 3 - {self.unique_id}')
     #Stage 4
     def stage_4(self):
         #print(f'Entering stage 4 - {self.unique_id}')
         #get_auction_results
+        #The winners are written once to the dispatcher, by the first cab
+        # asking for them
         self.model.update_winners()
 
-        for passenger in self.model.current_bidding_results.keys():
-            cab = self.model.current_bidding_results[passenger]
-            self.sighted_passengers[passenger] = cab
-            
-            passenger.has_cab_assigned = cab != None
-
-            #print(f'Cab {cab.unique_id if cab != None else "No one"} is assigned to passenger {passenger.unique_id if passenger != None else "No one"}')
-
         #print(f'Leaving stage 4 - {self.unique_id}')
     
     #Stage 5
@@ -209,46 +224,85 @@ class Cab(Agent):
             self.destination = passassigned.road_access
             if(self.pos == self.destination):
                 self.pickup_passenger(passassigned)
+        elif(not self.is_empty):
+            #The riders are dropped in the plan order
+            self.destination = self.passengers[0].destination
 
         #if empty and not moved, try to find a random destination
         while(not self.has_passenger_assigned and self.is_empty and self.pos == self.destination):
-            r = random.SystemRandom()
-            possible_places = list(self.model.roads.keys())
-            r.shuffle(possible_places)
-            self.destination = possible_places[0]
-
-        nextPos = self.model.routes[self.pos][self.destination]["next_pos"]
+            self.destination = self.model.random.choice(self.model.open_roads)
 
-        self.heading = (nextPos[0] - self.pos[0], nextPos[1] - self.pos[1])
-        self.model.grid.move_agent(self, nextPos)
-        self.pos = nextPos
-
-        #Update passengers travelled time
-        for p in self.passengers:
-            p.distance_travelled += 1
+        self.drive(self.model.cab_speed)
 
         #print(f'Last known pos = {self.pos}')
         #print(f'Leaving stage step - {self.unique_id}')
 
+    def drive(self, cells):
+        #Advance up to `cells` cells towards the destination, consuming
+        # the precomputed path segment, and touch the grid only once
+        routes = self.model.routes
+        destination = self.destination
+        segment = self.route_segment
+        pos = self.pos
+        last_pos = pos
+        moved = 0
+        travelled = 0
+
+        while(moved < cells and pos != destination):
+            if(len(segment) == 0 or self.segment_destination != destination):
+                #Kept reversed so the next cell is popped from the end
+                segment = routes.segment(pos, destination)[::-1]
+                self.route_segment = segment
+                self.segment_destination = destination
+
+            last_pos = pos
+            pos = segment.pop()
+            moved += 1
+            travelled += routes.cost(pos)
+
+        if(moved > 0):
+            self.heading = (pos[0] - last_pos[0], pos[1] - last_pos[1])
+            self.model.grid.move_agent(self, pos)
+            if(self.model.cab_index is not None):
+                self.model.cab_index.add(self, pos)
+            self.pos = pos
+
+        #The passengers travelled distance is read from the odometer, in
+        # the same road cost units as the routes distances
+        self.odometer += travelled
+
+        return moved
+
+    def path_ahead(self, cells=None):
+        #Cells from the current position to the destination, both
+        # included, or only the first `cells` cells driven
+        path = [self.pos]
+        while(path[-1] != self.destination and (cells is None or len(path) <= cells)):
+            path.append(self.model.routes.next_pos(path[-1], self.destination))
+
+        return path
+
     def drop_passenger(self):
         #print(f'Dropping passenger {self.passengers[0].unique_id} with destination to {self.passengers[0]} on {self.pos}')
         temp = self.passengers.pop(0)
 
+        #The rest of the plan is still right, only its first stop goes
+        if(self._plan is not None):
+            self._plan.drop_first()
+
         if(not self.is_empty):
             self.destination = self.passengers[0].destination
 
     def get_passengers_around(self):
-        neighbors = self.model.grid.get_neighbors(self.pos, True, include_center=False, radius=1)
-
-        passengers = [obj for obj in neighbors if isinstance(obj, Passenger)]
-
-        return passengers
+        return self.model.sightings.around(self.pos)
 
     def pickup_passenger(self, passenger):
         if(not self.has_free_seats):
             raise('Cannot add any more passengers.')
 
         passenger.distance_estimation = self.get_distance(self.pos, passenger.destination)
+        passenger.cab = self
+        passenger.pickup_odometer = self.odometer
 
         self.passengers.append(passenger)
         self.destination = self.passengers[0].destination
@@ -257,32 +311,107 @@ class Cab(Agent):
             self.prioritize_passenger_order()
 
         self.car_pooling = passenger.isCarPooler
+        self.replan()
  
         self.broadcast_pickup(passenger)
 
         passenger.auto_remove()
 
     def prioritize_passenger_order(self):
-        perm = permutations(self.passengers)
-
-        min_dist = None
-        best_order = None
-        for p in perm:
-            total_dist = self.get_distance(self.pos, p[0].destination)
-            
-            for i in range(0, len(p) - 1):
-                d = self.get_distance(p[i].destination, p[i+1].destination)
-                total_dist += d
-            
-            if(min_dist == None or total_dist < min_dist):
-                min_dist = total_dist
-                best_order = p
-        
-        self.passengers = list(best_order)
+        #Drop-off order with the shortest total distance from here
+        order = order_stops(self.pos, [p.destination for p in self.passengers], self.get_distance)
+
+        self.passengers = [self.passengers[idx] for idx in order]
         self.destination = self.passengers[0].destination
 
+    def insertion_bid(self, passenger):
+        #Extra distance the cab drives to take the passenger along: the
+        # pickup distance for an empty cab. None when it would take any
+        # rider (the new one included) more than MaxDetour over the
+        # direct distance to their destination, or when the cab cannot
+        # reach the passenger
+        factor = 1 + self.model.max_detour
+        plan = self.plan
+        slack = [factor * p.distance_estimation - p.distance_travelled - plan.left(self.odometer, idx)
+                 for idx, p in enumerate(self.passengers)]
+
+        direct = self.get_distance(passenger.road_access, passenger.destination)
+        if(direct < 0 or self.get_distance(self.pos, passenger.road_access) < 0):
+            return None
+
+        best = insertion_cost(self.pos, plan.stops, passenger.road_access, passenger.destination, self.get_distance,
+                              slack, factor * direct)
+        if(best is None):
+            return None
+
+        return best[0] - direct
+
+    def bid_distances(self, candidates):
+        #Distances from the cab to the road access of every candidate
+        return [self.get_distance(self.pos, p.road_access) for p in candidates]
+
     def get_distance(self, pos1, pos2):
         if(pos1 == pos2):
             return 0
         
-        return self.model.routes[pos1][pos2]["distance"]
\ No newline at end of file
+        return self.model.routes.distance(pos1, pos2)
+
+    def get_hops(self, pos1, pos2):
+        #Cells driven from pos1 to pos2, which is what the speed counts
+        if(pos1 == pos2):
+            return 0
+
+        return self.model.routes.hops(pos1, pos2)
+
+class FleetCab(Cab):
+    #Cab of the vectorized engine: a view over its slot of the model's
+    # Fleet arrays. It is not placed on the grid and does not drive by
+    # itself, the model advances the whole fleet at once
+    def __init__(self, unique_id, model, pos, heading=(1, 0)):
+        self.slot = model.fleet.add(pos, heading)
+        super().__init__(unique_id, model, pos, heading)
+
+    @property
+    def pos(self):
+        return self.model.fleet.cell(self.model.fleet.position.item(self.slot))
+
+    @pos.setter
+    def pos(self, pos):
+        #Agent.__init__ sets it to None before the cab is placed
+        if(pos is not None):
+            self.model.fleet.position[self.slot] = self.model.routes.index[pos]
+
+    @property
+    def destination(self):
+        return self.model.fleet.cell(self.model.fleet.destination.item(self.slot))
+
+    @destination.setter
+    def destination(self, pos):
+        self.model.fleet.destination[self.slot] = self.model.routes.index[pos]
+
+    @property
+    def heading(self):
+        return tuple(self.model.fleet.heading[self.slot].tolist())
+
+    @heading.setter
+    def heading(self, heading):
+        self.model.fleet.heading[self.slot] = heading
+
+    @property
+    def odometer(self):
+        return self.model.fleet.odometer.item(self.slot)
+
+    @odometer.setter
+    def odometer(self, odometer):
+        self.model.fleet.odometer[self.slot] = odometer
+
+    def bid_distances(self, candidates):
+        #Without bid candidates every cab bids for all the waiting
+        # passengers: its row of the distances gathered for all the cabs
+        if(self.model.bid_candidates > 0):
+            return super().bid_distances(candidates)
+
+        return self.model.waiting_distances()[self.slot].tolist()
+
+    def drive(self, cells):
+        return 0
@@ -0,0 +1,51 @@
+import itertools
+import multiprocessing
+
+import pandas as pd
+
+from .model import CityModel
+from .utils import ROUTE_CACHE_DIR, getCityCache, loadCity, readCityMap
+
+#City loaded once per worker process. The routing matrices are
+# memory-mapped read-only from the route cache, so every worker
+# shares the same physical pages instead of holding its own copy.
+worker_city = None
+
+def init_worker(map_filename, cache_directory):
+    global worker_city
+
+    city_map = readCityMap(map_filename)
+    worker_city = (city_map,) + loadCity(cache_directory, mmap_mode="r")
+
+def run_model(params, steps):
+    city_map, city_roads, city_blocks, passenger_blocks, routes = worker_city
+
+    model = CityModel(PassengerBlocks=passenger_blocks, width=len(city_map[0]), height=len(city_map), city_map=city_map,
+                      roads=city_roads, city_blocks=city_blocks, routes=routes, **params)
+
+    for _ in range(steps):
+        model.step()
+
+    results = dict(params)
+    results.update(model.datacollector.get_model_vars_dataframe().iloc[-1].to_dict())
+
+    return results
+
+def run_sweep(map_filename, parameters, steps=100, iterations=1, processes=None, cache_dir=ROUTE_CACHE_DIR):
+    #Runs one CityModel per combination of the parameter values (times
+    # iterations) in a pool of worker processes and returns the last
+    # collected model variables of every run
+    cache_directory = getCityCache(map_filename, cache_dir)
+
+    names = list(parameters.keys())
+    runs = [dict(zip(names, values)) for values in itertools.product(*parameters.values())] * iterations
+
+    #Every run gets its own seed unless the sweep sets them, so a sweep
+    # gives the same results every time it runs
+    if("seed" not in parameters):
+        runs = [dict(params, seed=seed) for seed, params in enumerate(runs)]
+
+    with multiprocessing.Pool(processes, initializer=init_worker, initargs=(map_filename, cache_directory)) as pool:
+        results = pool.starmap(run_model, [(params, steps) for params in runs])
+
+    return pd.DataFrame(results)
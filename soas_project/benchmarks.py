@@ -0,0 +1,576 @@
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from .agents import Cab, Passenger
+from .dispatch import ASSIGNMENTS, greedy_rescan_assignment, linear_sum_assignment
+from .model import CityModel
+from .planning import held_karp_order, insertion_order, leg_matrix, permutation_order, route_length
+from .routing import CLOSED
+from .spatial import GridIndex, SightingTable
+from .utils import getRoads, getRouteTable, getShortestPaths, makeGridMap, readCityMap, writeCityMap
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+
+    return result, time.perf_counter() - start
+
+def bench_startup(block_counts=(2, 4, 6, 8, 10), block_size=4):
+    #Startup time (map parsing + routes) versus map size
+    print(f'{"map":>9} {"roads":>7} {"startup (s)":>12}')
+
+    for blocks in block_counts:
+        city_map = makeGridMap(blocks, block_size)
+        height = len(city_map)
+        width = len(city_map[0])
+
+        (city_roads, _, _, _), elapsed = timed(getRoads, city_map, height, width)
+
+        print(f'{f"{width}x{height}":>9} {len(city_roads):>7} {elapsed:>12.3f}')
+
+def measured(func, *args):
+    #Result, elapsed time and peak traced memory (in bytes) of a call
+    tracemalloc.start()
+    result, elapsed = timed(func, *args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, elapsed, peak
+
+def bench_routes(block_counts=(4, 6, 8), block_size=4, lookups=100000):
+    #Dict-of-dicts routes versus the dense RouteTable: build time,
+    # memory and per-lookup latency of next_pos + distance
+    print(f'{"map":>7} {"backend":>7} {"build (s)":>10} {"memory (MB)":>12} {"lookup (ns)":>12}')
+
+    for blocks in block_counts:
+        city_map = makeGridMap(blocks, block_size)
+        city_roads, _, _, _ = getRoads(city_map, len(city_map), len(city_map[0]))
+
+        r = random.Random(0)
+        cells = list(city_roads.keys())
+        pairs = [tuple(r.sample(cells, 2)) for _ in range(lookups)]
+
+        routes, build, peak = measured(getShortestPaths, city_roads)
+        start = time.perf_counter()
+        for pos1, pos2 in pairs:
+            routes[pos1][pos2]["next_pos"]
+            routes[pos1][pos2]["distance"]
+        latency = (time.perf_counter() - start) / lookups * 1e9
+        print(f'{len(city_map):>7} {"dict":>7} {build:>10.3f} {peak / 2**20:>12.1f} {latency:>12.0f}')
+        del routes
+
+        table, build, peak = measured(getRouteTable, city_roads)
+        start = time.perf_counter()
+        for pos1, pos2 in pairs:
+            table.next_pos(pos1, pos2)
+            table.distance(pos1, pos2)
+        latency = (time.perf_counter() - start) / lookups * 1e9
+        print(f'{len(city_map):>7} {"table":>7} {build:>10.3f} {table.nbytes / 2**20:>12.1f} {latency:>12.0f}')
+
+def make_model(city_map, routing="table", **params):
+    #Seeded unless asked otherwise, so that benchmarks are repeatable
+    params.setdefault("seed", 0)
+    height = len(city_map)
+    width = len(city_map[0])
+    city_roads, city_blocks, passenger_blocks, routes = getRoads(city_map, height, width, routing)
+
+    return CityModel(PassengerBlocks=passenger_blocks, width=width, height=height, city_map=city_map,
+                     roads=city_roads, city_blocks=city_blocks, routes=routes, **params)
+
+def bench_lazy(blocks=40, block_size=4, cabs=20, steps=50):
+    #Simulation on a map too big for the all-pairs table, with routes
+    # computed on demand by LazyRouteTable
+    city_map = makeGridMap(blocks, block_size)
+    model, elapsed = timed(make_model, city_map, "lazy", N=cabs)
+    routes = model.routes
+
+    print(f'map {len(city_map)}x{len(city_map)}, {len(routes)} road cells '
+          f'(a full table would take {2 * 4 * len(routes) ** 2 / 2**20:.0f} MB)')
+    print(f'setup: {elapsed:.2f} s')
+
+    _, elapsed = timed(lambda: [model.step() for _ in range(steps)])
+    print(f'{steps} steps: {elapsed:.2f} s, {routes.hits} hits, {routes.misses} misses, '
+          f'{len(routes.trees)} trees cached ({routes.nbytes / 2**20:.1f} MB)')
+
+def bench_grid(block_counts=(10, 50, 100, 200), block_size=4, lookups=100000):
+    #Analytic GridRouteTable on regular maps hundreds of blocks across
+    print(f'{"map":>9} {"roads":>7} {"setup (s)":>10} {"lookup (ns)":>12}')
+
+    for blocks in block_counts:
+        city_map = makeGridMap(blocks, block_size)
+        (city_roads, _, _, routes), elapsed = timed(getRoads, city_map, len(city_map), len(city_map[0]), "grid")
+
+        r = random.Random(0)
+        cells = list(city_roads.keys())
+        pairs = [(r.choice(cells), r.choice(cells)) for _ in range(lookups)]
+
+        start = time.perf_counter()
+        for pos1, pos2 in pairs:
+            routes.next_pos(pos1, pos2)
+            routes.distance(pos1, pos2)
+        latency = (time.perf_counter() - start) / lookups * 1e9
+
+        print(f'{f"{len(city_map)}x{len(city_map)}":>9} {len(city_roads):>7} {elapsed:>10.2f} {latency:>12.0f}')
+
+def bench_drive(speeds=(1, 2, 4), cabs=200, ticks=200):
+    #Cost per cell driven: one routes lookup and one grid move per cell,
+    # as cabs used to move, against consuming path segments `speed`
+    # cells per tick with Cab.drive (36x36 map)
+    city_map = makeGridMap(5, 6)
+    model = make_model(city_map, N=cabs)
+    cells = list(model.roads.keys())
+    cabs_list = model.cabs
+    r = random.Random(0)
+
+    def retarget(cab):
+        while(cab.pos == cab.destination):
+            cab.destination = r.choice(cells)
+
+    print(f'{"mode":>12} {"cells":>8} {"us/cell":>8}')
+
+    driven = 0
+    start = time.perf_counter()
+    for _ in range(ticks):
+        for cab in cabs_list:
+            retarget(cab)
+            next_pos = model.routes.next_pos(cab.pos, cab.destination)
+            model.grid.move_agent(cab, next_pos)
+            cab.pos = next_pos
+            driven += 1
+    print(f'{"per cell":>12} {driven:>8} {(time.perf_counter() - start) / driven * 1e6:>8.2f}')
+
+    for speed in speeds:
+        driven = 0
+        start = time.perf_counter()
+        for _ in range(ticks):
+            for cab in cabs_list:
+                retarget(cab)
+                driven += cab.drive(speed)
+        print(f'{f"speed {speed}":>12} {driven:>8} {(time.perf_counter() - start) / driven * 1e6:>8.2f}')
+
+def bench_load(blocks=200, block_size=4):
+    #Loading a 1001x1001 map from the text and the binary format, and
+    # deriving roads, blocks and passenger blocks from it
+    city_map = makeGridMap(blocks, block_size)
+
+    with tempfile.TemporaryDirectory() as directory:
+        text_file = os.path.join(directory, "city_map.txt")
+        binary_file = os.path.join(directory, "city_map.npy")
+        np.savetxt(text_file, city_map, fmt="%d", delimiter="\t")
+        writeCityMap(binary_file, city_map)
+
+        print(f'map {len(city_map)}x{len(city_map[0])}')
+        _, elapsed = timed(readCityMap, text_file)
+        print(f'read text map:   {elapsed:.3f} s ({os.path.getsize(text_file) / 2**20:.1f} MB)')
+        loaded, elapsed = timed(readCityMap, binary_file)
+        print(f'read binary map: {elapsed:.3f} s ({os.path.getsize(binary_file) / 2**20:.1f} MB)')
+
+    (city_roads, city_blocks, passenger_blocks, _), elapsed = timed(getRoads, loaded, len(loaded), len(loaded[0]), "grid")
+    print(f'getRoads:        {elapsed:.3f} s ({len(city_roads)} roads, {len(city_blocks)} blocks, '
+          f'{len(passenger_blocks)} passenger blocks)')
+
+def bench_weighted(blocks=5, block_size=6, changes=50):
+    #Dijkstra routes on a 36x36 map with random road costs: full build
+    # against repairing the table after a single cost change
+    r = random.Random(0)
+    city_map = makeGridMap(blocks, block_size)
+    city_map[city_map == 0] = [r.choice([10, 10, 20, 30]) for _ in range((city_map == 0).sum())]
+
+    (city_roads, _, _, routes), elapsed = timed(getRoads, city_map, len(city_map), len(city_map[0]))
+    print(f'full build: {elapsed:.3f} s ({len(city_roads)} roads)')
+
+    cells = list(city_roads.keys())
+    repaired = 0
+    start = time.perf_counter()
+    for _ in range(changes):
+        repaired += routes.set_cost(r.choice(cells), r.choice([1, 2, 3, 5]))
+    elapsed = (time.perf_counter() - start) / changes
+    print(f'set_cost:   {elapsed:.3f} s per change ({repaired / changes:.0f} of {len(cells)} trees repaired)')
+
+def bench_closures(blocks=5, block_size=6, closures=50):
+    #Closing and reopening road cells of a running 36x36 model against
+    # recomputing the whole routing table around the closed cell
+    r = random.Random(0)
+    model = make_model(makeGridMap(blocks, block_size))
+    candidates = [pos for pos in model.roads.keys() if pos not in model.passenger_blocks.values()]
+
+    closed = []
+    start = time.perf_counter()
+    while(len(closed) < closures):
+        pos = r.choice(candidates)
+        try:
+            model.close_road(pos)
+        except ValueError:
+            continue
+        closed.append(pos)
+        model.reopen_road(pos)
+    elapsed = (time.perf_counter() - start) / (2 * closures)
+    print(f'close/reopen: {elapsed:.3f} s per change ({len(model.roads)} roads)')
+
+    start = time.perf_counter()
+    for pos in closed[:10]:
+        getRouteTable(model.roads, {pos: CLOSED})
+    elapsed = (time.perf_counter() - start) / len(closed[:10])
+    print(f'full rebuild: {elapsed:.3f} s per change')
+
+def bench_dispatch(cab_counts=(10, 100, 1000), blocks=20, block_size=4, max_rescan=10**8):
+    #Latency and total pickup distance of each assignment engine, with
+    # as many waiting passengers as cabs and every cab bidding for every
+    # passenger. The greedy rescan, which the heap-based greedy engine
+    # replaced, is skipped when it would take too long
+    city_map = makeGridMap(blocks, block_size)
+    city_roads, _, passenger_blocks, routes = getRoads(city_map, len(city_map), len(city_map[0]), "grid")
+    r = random.Random(0)
+    cells = list(city_roads.keys())
+    accesses = list(passenger_blocks.values())
+
+    print(f'map {len(city_map)}x{len(city_map)}, optimal solver: {"scipy" if linear_sum_assignment else "numpy"}')
+    print(f'{"cabs":>6} {"engine":>8} {"matched":>8} {"pickup distance":>16} {"latency (ms)":>13}')
+
+    for cabs in cab_counts:
+        positions = [r.choice(cells) for _ in range(cabs)]
+        passengers = [r.choice(accesses) for _ in range(cabs)]
+        all_biddings = {cab: {psg: routes.distance(pos, access) for psg, access in enumerate(passengers)}
+                        for cab, pos in enumerate(positions)}
+
+        engines = dict(rescan=greedy_rescan_assignment, **ASSIGNMENTS)
+        for name, assignment in engines.items():
+            if(name == "rescan" and cabs ** 3 > max_rescan):
+                print(f'{cabs:>6} {name:>8} {"-":>8} {"-":>16} {"-":>13}')
+                continue
+
+            winners, elapsed = timed(assignment, all_biddings)
+            winners = {psg: cab for psg, cab in winners.items() if cab is not None}
+            distance = sum(all_biddings[cab][psg] for psg, cab in winners.items())
+            print(f'{cabs:>6} {name:>8} {len(winners):>8} {distance:>16} {elapsed * 1000:>13.1f}')
+
+def bench_batching(windows=((1, 0), (2, 0), (4, 0), (8, 0), (8, 5)), cabs=20, steps=300):
+    #Average passenger waiting time and dispatch CPU time per tick for
+    # several dispatch windows (interval, new passengers threshold) on
+    # the 36x36 map
+    city_map = makeGridMap(5, 6)
+
+    print(f'{"interval":>8} {"threshold":>9} {"waiting":>8} {"dispatch (ms/tick)":>19}')
+
+    for interval, threshold in windows:
+        model = make_model(city_map, N=cabs, PassengerPopulation=.3,
+                           DispatchInterval=interval, DispatchThreshold=threshold)
+        for _ in range(steps):
+            model.step()
+
+        results = model.datacollector.get_model_vars_dataframe()
+        print(f'{interval:>8} {threshold:>9} {results["Average"].mean():>8.1f} '
+              f'{results["Dispatch CPU time (ms)"].mean():>19.3f}')
+
+def bench_insertion(modes=(("distance", None), ("insertion", .2), ("insertion", .5), ("insertion", 1)),
+                    cabs=20, steps=300):
+    #Overtravelled percentage, pooling riders, waiting time and dispatch
+    # CPU time per tick of the pooling bid modes on the 36x36 map
+    city_map = makeGridMap(5, 6)
+
+    print(f'{"bid mode":>9} {"max detour":>10} {"overtravelled (%)":>17} {"pooling riders":>14} {"waiting":>8} '
+          f'{"dispatch (ms/tick)":>19}')
+
+    for mode, max_detour in modes:
+        params = {"BidMode": mode}
+        if(max_detour is not None):
+            params["MaxDetour"] = max_detour
+
+        model = make_model(city_map, N=cabs, PassengerPopulation=.3, **params)
+        for _ in range(steps):
+            model.step()
+
+        results = model.datacollector.get_model_vars_dataframe()
+        print(f'{mode:>9} {"-" if max_detour is None else max_detour:>10} '
+              f'{results["Overtravelled (in percentage)"].mean():>17.1f} '
+              f'{results["Passengers Travelling (pooling)"].mean():>14.2f} {results["Average"].mean():>8.1f} '
+              f'{results["Dispatch CPU time (ms)"].mean():>19.3f}')
+
+class ScanCab(Cab):
+    #Cab answering the assignment queries by scanning every sighted
+    # passenger, as before the dispatcher kept the cab -> passenger index
+    @property
+    def has_passenger_assigned(self):
+        for passg in self.sighted_passengers.keys():
+            if (self.sighted_passengers[passg] != None and self.sighted_passengers[passg].unique_id == self.unique_id):
+                return True
+
+        return False
+
+    @property
+    def passenger_assigned(self):
+        for passg in self.sighted_passengers.keys():
+            if (self.sighted_passengers[passg] != None and self.sighted_passengers[passg].unique_id == self.unique_id):
+                return passg
+
+        return None
+
+    @property
+    def unasigned_passenger(self):
+        return [a for a in self.sighted_passengers.keys() if self.sighted_passengers[a] == None]
+
+def bench_assigned(sighted=1000, cabs=100, assigned=.5, bid_candidates=(0, 5), rounds=5):
+    #Cab.stage_3 + Cab.step per cab with 1000 sighted passengers, half
+    # of the cabs with a passenger assigned, answering the assignment
+    # queries with the scans against the dispatcher's reverse index
+    city_map = makeGridMap(10, 4)
+
+    print(f'{sighted} sighted passengers, {cabs} cabs')
+    print(f'{"bid candidates":>14} {"queries":>7} {"stage_3 + step (us/cab)":>24}')
+
+    for k, cab_class in itertools.product(bid_candidates, (ScanCab, Cab)):
+        model = make_model(city_map, N=cabs, PassengerPopulation=0, BidCandidates=k)
+        r = random.Random(0)
+        accesses = list(model.passenger_blocks.values())
+        cells = list(model.roads.keys())
+
+        for idx in range(sighted):
+            access = r.choice(accesses)
+            passenger = Passenger(model.unique_id_counter + idx, model, access, r.choice(cells), access, r.random() < .5)
+            model.dispatcher.sight(passenger)
+
+        for cab, passenger in zip(model.cabs[:int(cabs * assigned)], list(model.dispatcher.waiting)):
+            model.dispatcher.assign(passenger, cab)
+
+        for cab in model.cabs:
+            cab.__class__ = cab_class
+
+        def stage_3_and_step():
+            for cab in model.cabs:
+                cab.stage_3()
+                cab.step()
+            model.all_biddings = {}
+
+        _, elapsed = timed(lambda: [stage_3_and_step() for _ in range(rounds)])
+        queries = "scan" if cab_class is ScanCab else "index"
+        print(f'{k if k > 0 else "all":>14} {queries:>7} {elapsed / rounds / cabs * 1e6:>24.1f}')
+
+def bench_sighting(radii=(1, 2, 3), blocks=20, block_size=4, cabs=200, queries=20):
+    #Passengers seen by every cab from its position: the grid neighbors
+    # scan the cabs did every tick against the precomputed SightingTable,
+    # with the time to build the table when the model starts
+    city_map = makeGridMap(blocks, block_size)
+
+    print(f'map {len(city_map)}x{len(city_map)}, {cabs} cabs')
+    print(f'{"radius":>6} {"table setup (ms)":>17} {"grid (us/cab)":>14} {"table (us/cab)":>15}')
+
+    for radius in radii:
+        model = make_model(city_map, N=cabs, PassengerPopulation=.5, SightingRadius=radius)
+        roads = model.roads.keys()
+        neighborhood = lambda cell: model.grid.get_neighborhood(cell, True, include_center=False, radius=radius)
+        _, setup = timed(SightingTable, model.passenger_blocks.keys(), roads, neighborhood)
+
+        def grid_scan():
+            for cab in model.cabs:
+                neighbors = model.grid.get_neighbors(cab.pos, True, include_center=False, radius=radius)
+                [obj for obj in neighbors if isinstance(obj, Passenger)]
+
+        def table_lookup():
+            for cab in model.cabs:
+                cab.get_passengers_around()
+
+        _, grid_time = timed(lambda: [grid_scan() for _ in range(queries)])
+        _, table_time = timed(lambda: [table_lookup() for _ in range(queries)])
+
+        print(f'{radius:>6} {setup * 1000:>17.1f} {grid_time / queries / cabs * 1e6:>14.2f} '
+              f'{table_time / queries / cabs * 1e6:>15.2f}')
+
+def bench_spatial(counts=(100, 1000, 5000), k=5, blocks=50, block_size=4, queries=200):
+    #Finding the k nearest passengers of a cab (by route distance) by
+    # scanning all of them, as the cabs bid, against the GridIndex
+    city_map = makeGridMap(blocks, block_size)
+    city_roads, _, passenger_blocks, routes = getRoads(city_map, len(city_map), len(city_map[0]), "grid")
+    r = random.Random(0)
+    cells = list(city_roads.keys())
+    accesses = list(passenger_blocks.values())
+
+    print(f'map {len(city_map)}x{len(city_map)}, k = {k}')
+    print(f'{"passengers":>10} {"scan (ms)":>10} {"index (ms)":>11}')
+
+    for count in counts:
+        passengers = {psg: r.choice(accesses) for psg in range(count)}
+        index = GridIndex()
+        for psg, access in passengers.items():
+            index.add(psg, access)
+
+        positions = [r.choice(cells) for _ in range(queries)]
+        distance = lambda pos1, pos2: 0 if pos1 == pos2 else routes.distance(pos1, pos2)
+
+        start = time.perf_counter()
+        for pos in positions:
+            sorted(passengers.keys(), key=lambda psg: distance(pos, passengers[psg]))[:k]
+        scan = (time.perf_counter() - start) / queries
+
+        start = time.perf_counter()
+        for pos in positions:
+            index.nearest(pos, k, lambda access: distance(pos, access))
+        indexed = (time.perf_counter() - start) / queries
+
+        print(f'{count:>10} {scan * 1000:>10.3f} {indexed * 1000:>11.3f}')
+
+class ScanRegistries:
+    #The model as the datacollector reporters saw it before the cab and
+    # passenger registries: every read filters the whole schedule
+    def __init__(self, model):
+        self.model = model
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    @property
+    def cabs(self):
+        return [a for a in self.model.schedule.agents if isinstance(a, Cab)]
+
+    @property
+    def passengers(self):
+        return {a: None for a in self.model.schedule.agents if isinstance(a, Passenger)}
+
+def scan_reporters(model):
+    #Makes every reporter of the model scan the schedule again
+    reporters = model.datacollector.model_reporters
+    for name, reporter in reporters.items():
+        reporters[name] = lambda m, reporter=reporter: reporter(ScanRegistries(m))
+
+def bench_step(cab_counts=(10, 50), warmup=20, steps=200):
+    #Time per model step on the 36x36 map, including the datacollector,
+    # with the reporters scanning the schedule against reading the
+    # registries. Both runs are seeded alike and simulate the same thing
+    city_map = makeGridMap(5, 6)
+
+    print(f'{"cabs":>5} {"agents":>7} {"reporters":>9} {"ms/step":>8}')
+
+    for cabs, reporters in itertools.product(cab_counts, ("scan", "registry")):
+        model = make_model(city_map, N=cabs, PassengerPopulation=.3)
+        if(reporters == "scan"):
+            scan_reporters(model)
+
+        for _ in range(warmup):
+            model.step()
+
+        _, elapsed = timed(lambda: [model.step() for _ in range(steps)])
+        print(f'{cabs:>5} {len(model.schedule.agents):>7} {reporters:>9} {elapsed / steps * 1000:>8.2f}')
+
+def bench_fleet(cab_counts=(1000, 10000), blocks=16, block_size=4, ticks=10, bid_candidates=3):
+    #Driving the cabs one cell per tick: Cab.drive on every cab object
+    # against one vectorized Fleet.advance, then a whole model step with
+    # each engine, with every free cab bidding for every waiting
+    # passenger and with `bid_candidates` per cab. The vector engine
+    # gathers the bid distances of all the cabs at once, but the auction
+    # itself still handles every bid in Python
+    city_map = makeGridMap(blocks, block_size)
+    r = np.random.default_rng(0)
+
+    print(f'map {len(city_map)}x{len(city_map)}')
+    print(f'{"cabs":>6} {"engine":>7} {"drive (ms/tick)":>16} {"step (ms/tick)":>15} '
+          f'{f"step, {bid_candidates} candidates":>22}')
+
+    for cabs, engine in itertools.product(cab_counts, ("tick", "vector")):
+        model = make_model(city_map, N=cabs, Engine=engine)
+        cells = len(model.routes.cells)
+
+        start = time.perf_counter()
+        for _ in range(ticks):
+            if(engine == "vector"):
+                fleet = model.fleet
+                arrived = fleet.position == fleet.destination
+                fleet.destination[arrived] = r.integers(0, cells, arrived.sum())
+                fleet.advance(1)
+            else:
+                for cab in model.cabs:
+                    if(cab.pos == cab.destination):
+                        cab.destination = model.routes.cells[r.integers(0, cells)]
+                    cab.drive(1)
+        drive = (time.perf_counter() - start) / ticks
+
+        steps = []
+        for candidates in (0, bid_candidates):
+            model = make_model(city_map, N=cabs, Engine=engine, BidCandidates=candidates)
+            _, elapsed = timed(lambda: [model.step() for _ in range(ticks)])
+            steps.append(elapsed / ticks * 1000)
+        print(f'{cabs:>6} {engine:>7} {drive * 1000:>16.1f} {steps[0]:>15.1f} {steps[1]:>22.1f}')
+
+def bench_events(settings=((2, .02), (10, .1), (50, .3)), horizon=5000):
+    #Simulating a long horizon on the 36x36 map with the tick engine
+    # against the event engine, which only runs the ticks with events.
+    # Without shuffling, both engines simulate exactly the same thing
+    city_map = makeGridMap(5, 6)
+
+    print(f'{"cabs":>5} {"population":>10} {"engine":>7} {"ticks run":>10} {"time (s)":>9}')
+
+    for cabs, population in settings:
+        for engine in ("tick", "event"):
+            model = make_model(city_map, N=cabs, PassengerPopulation=population, Engine=engine)
+            model.schedule.shuffle = False
+
+            start = time.perf_counter()
+            steps = 0
+            while(model.time < horizon):
+                model.step()
+                steps += 1
+            elapsed = time.perf_counter() - start
+
+            print(f'{cabs:>5} {population:>10} {engine:>7} {steps:>10} {elapsed:>9.2f}')
+
+def bench_ordering(seat_counts=(3, 6, 8, 10, 12), cases=20, max_permutations=8):
+    #Drop-off order of a cab with n passengers on the 36x36 map: every
+    # permutation against Held-Karp and the insertion heuristic, with
+    # the length of the insertion order over the optimum
+    model = make_model(makeGridMap(5, 6), N=0)
+    r = random.Random(0)
+    cells = list(model.roads.keys())
+    distance = lambda pos1, pos2: 0 if pos1 == pos2 else model.routes.distance(pos1, pos2)
+
+    print(f'{"seats":>5} {"permutations (ms)":>18} {"held-karp (ms)":>15} {"insertion (ms)":>15} {"insertion gap":>14}')
+
+    for seats in seat_counts:
+        all_legs = [leg_matrix(r.choice(cells), r.sample(cells, seats), distance) for _ in range(cases)]
+
+        brute = "-"
+        if(seats <= max_permutations):
+            _, elapsed = timed(lambda: [permutation_order(legs) for legs in all_legs])
+            brute = f'{elapsed / cases * 1000:.2f}'
+
+        exact, exact_time = timed(lambda: [held_karp_order(legs) for legs in all_legs])
+        heuristic, heuristic_time = timed(lambda: [insertion_order(legs) for legs in all_legs])
+
+        optimum = sum(route_length(legs, order) for legs, order in zip(all_legs, exact))
+        found = sum(route_length(legs, order) for legs, order in zip(all_legs, heuristic))
+
+        print(f'{seats:>5} {brute:>18} {exact_time / cases * 1000:>15.2f} {heuristic_time / cases * 1000:>15.3f} '
+              f'{(found / optimum - 1) * 100:>13.1f}%')
+
+BENCHMARKS = {
+    "startup": bench_startup,
+    "routes": bench_routes,
+    "lazy": bench_lazy,
+    "grid": bench_grid,
+    "drive": bench_drive,
+    "load": bench_load,
+    "weighted": bench_weighted,
+    "closures": bench_closures,
+    "dispatch": bench_dispatch,
+    "batching": bench_batching,
+    "spatial": bench_spatial,
+    "step": bench_step,
+    "fleet": bench_fleet,
+    "events": bench_events,
+    "ordering": bench_ordering,
+    "insertion": bench_insertion,
+    "assigned": bench_assigned,
+    "sighting": bench_sighting,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS.keys())
+
+    for name in names:
+        print(f'== {name} ==')
+        BENCHMARKS[name]()
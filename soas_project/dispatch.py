@@ -0,0 +1,247 @@
+import heapq
+import math
+
+import numpy as np
+
+from .spatial import GridIndex
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+#Assignment engines take the biddings of one tick ({cab: {passenger:
+# distance}}) and return the winners as {passenger: cab}
+
+def greedy_rescan_assignment(all_biddings):
+    #Repeatedly gives the passenger with the closest cab to that cab.
+    # Passengers left without any free cab bidding for them get None.
+    # Rescans every remaining bid for every assignment, kept as the
+    # reference for greedy_assignment
+    passenger_assignment = {}
+
+    number_of_cabs_bidding = len(all_biddings)
+
+    #Ordered by first bid, so that ties do not depend on object hashes
+    passengers_being_bidded = {}
+
+    for cab in all_biddings.keys():
+        for psg in all_biddings[cab].keys():
+            passengers_being_bidded[psg] = None
+
+    number_of_passengers = len(passengers_being_bidded)
+
+    while(len(passenger_assignment) < number_of_cabs_bidding and len(passenger_assignment) < number_of_passengers):
+        passengers_all_distances = {}
+        passenger_assignment_temp = {}
+        for cab in all_biddings.keys():
+            if (cab not in passenger_assignment.values()):
+                for psg in passengers_being_bidded:
+                    if (psg not in passenger_assignment.keys()):
+                        cab_bidding_for_this_pass = psg in all_biddings[cab].keys()
+
+                        if(cab_bidding_for_this_pass):
+                            pass_dist = all_biddings[cab][psg]
+                        else:
+                            pass_dist = math.inf
+
+                        if(psg not in passengers_all_distances or passengers_all_distances[psg] > pass_dist):
+                            passengers_all_distances[psg] = pass_dist
+                            passenger_assignment_temp[psg] = cab if cab_bidding_for_this_pass else None
+
+        #order the passengers by the distance to the closest cab
+        passengers_all_distances = sorted(passengers_all_distances.items(), key=lambda kv: kv[1])
+
+        #get the passenger who has the closest cab
+        passenger = passengers_all_distances[0][0]
+        #get the cab
+        cab = passenger_assignment_temp[passenger]
+
+        passenger_assignment[passenger] = cab
+
+    return passenger_assignment
+
+def greedy_assignment(all_biddings):
+    #Same winners as greedy_rescan_assignment, but every bid is pushed
+    # into a heap once and the smallest one whose cab and passenger are
+    # both still free is popped, in O(B log B) for B bids. Ties are
+    # broken like the rescan: first passenger bid on, then
+    # first cab in bidding order
+    #Ordered by first bid, so that ties do not depend on object hashes
+    passengers_being_bidded = {}
+
+    for cab in all_biddings.keys():
+        for psg in all_biddings[cab].keys():
+            passengers_being_bidded[psg] = None
+
+    passengers = list(passengers_being_bidded)
+    passenger_rank = {psg: idx for idx, psg in enumerate(passengers)}
+    cabs = list(all_biddings.keys())
+
+    bids = [(distance, passenger_rank[psg], cab_rank)
+            for cab_rank, cab in enumerate(cabs) for psg, distance in all_biddings[cab].items()]
+    heapq.heapify(bids)
+
+    number_of_assignments = min(len(cabs), len(passengers))
+    passenger_assignment = {}
+    assigned_cabs = set()
+
+    while(bids and len(passenger_assignment) < number_of_assignments):
+        _, psg_rank, cab_rank = heapq.heappop(bids)
+        psg = passengers[psg_rank]
+
+        if(psg not in passenger_assignment and cab_rank not in assigned_cabs):
+            passenger_assignment[psg] = cabs[cab_rank]
+            assigned_cabs.add(cab_rank)
+
+    #The rescan gives None to the passengers left without bids, in
+    # order, until there are as many assignments as cabs or passengers
+    for psg in passengers:
+        if(len(passenger_assignment) == number_of_assignments):
+            break
+
+        if(psg not in passenger_assignment):
+            passenger_assignment[psg] = None
+
+    return passenger_assignment
+
+def hungarian(cost):
+    #Minimum cost assignment of the rows of a dense n x m cost matrix
+    # (n <= m) to distinct columns, with shortest augmenting paths and
+    # row/column potentials. Returns the rows and their columns, like
+    # linear_sum_assignment
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    match = np.zeros(m + 1, dtype=np.int64)    # column -> row, 1-based, 0 when free
+    way = np.zeros(m + 1, dtype=np.int64)
+
+    for row in range(1, n + 1):
+        match[0] = row
+        col0 = 0
+        min_reduced = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+
+        while(match[col0] != 0):
+            used[col0] = True
+            free = ~used[1:]
+            reduced = cost[match[col0] - 1] - u[match[col0]] - v[1:]
+
+            better = free & (reduced < min_reduced[1:])
+            min_reduced[1:][better] = reduced[better]
+            way[1:][better] = col0
+
+            candidates = np.where(free, min_reduced[1:], np.inf)
+            col1 = int(np.argmin(candidates)) + 1
+            delta = candidates[col1 - 1]
+
+            u[match[used]] += delta
+            v[used] -= delta
+            min_reduced[1:][free] -= delta
+            col0 = col1
+
+        #Flip the augmenting path
+        while(col0 != 0):
+            col1 = way[col0]
+            match[col0] = match[col1]
+            col0 = col1
+
+    cols = np.nonzero(match[1:])[0]
+    rows = match[1:][cols] - 1
+    order = np.argsort(rows)
+
+    return rows[order], cols[order]
+
+def solve_assignment(cost):
+    if(linear_sum_assignment is not None):
+        return linear_sum_assignment(cost)
+
+    if(cost.shape[0] > cost.shape[1]):
+        cols, rows = hungarian(cost.T)
+        order = np.argsort(rows)
+        return rows[order], cols[order]
+
+    return hungarian(cost)
+
+def optimal_assignment(all_biddings):
+    #Matches as many bid-on passengers as possible and, among those
+    # matchings, the one with the smallest total pickup distance.
+    # Uses scipy's linear_sum_assignment when scipy is installed
+    cabs = list(all_biddings.keys())
+    passengers = list(dict.fromkeys(psg for offers in all_biddings.values() for psg in offers.keys()))
+
+    if(len(cabs) == 0 or len(passengers) == 0):
+        return {}
+
+    column = {psg: idx for idx, psg in enumerate(passengers)}
+    rows = [idx for idx, cab in enumerate(cabs) for _ in all_biddings[cab]]
+    cols = [column[psg] for cab in cabs for psg in all_biddings[cab].keys()]
+    distances = [distance for cab in cabs for distance in all_biddings[cab].values()]
+
+    #Bids can be negative (insertion bids), so the costs are shifted to
+    # start at 0. Pairs without a bid cost more than any matching with
+    # one more real pair, so they are only used to fill the matrix
+    lowest = min(distances)
+    no_bid = (max(distances) - lowest) * min(len(cabs), len(passengers)) + 1
+    cost = np.full((len(cabs), len(passengers)), float(no_bid))
+    cost[rows, cols] = np.array(distances, dtype=float) - lowest
+
+    return {passengers[col]: cabs[row] for row, col in zip(*solve_assignment(cost)) if cost[row, col] < no_bid}
+
+class Dispatcher:
+    #Blackboard shared by all the cabs: every sighted passenger still
+    # waiting for a pickup, with the cab assigned to it (None while it
+    # has none), the passenger every cab is going to pick up, and a
+    # spatial index of the ones without a cab. Sightings, assignments and
+    # pickups are single writes here instead of messages to every cab
+    def __init__(self):
+        self.assignments = {}
+        self.assigned = {}    # cab -> passenger it is going to pick up
+        self.sighted = 0    # passengers ever sighted
+        self.unassigned = GridIndex()
+
+    def __len__(self):
+        return len(self.assignments)
+
+    def __contains__(self, passenger):
+        return passenger in self.assignments
+
+    @property
+    def waiting(self):
+        #Sighted passengers without a cab, in the order they were sighted
+        return self.unassigned.positions.keys()
+
+    def sight(self, passenger):
+        if(passenger in self.assignments):
+            return
+
+        self.assignments[passenger] = None
+        self.unassigned.add(passenger, passenger.road_access)
+        self.sighted += 1
+        passenger.visualized = True
+
+    def assign(self, passenger, cab):
+        previous = self.assignments.get(passenger)
+        if(previous != None and self.assigned.get(previous) is passenger):
+            del self.assigned[previous]
+
+        self.assignments[passenger] = cab
+        passenger.has_cab_assigned = cab != None
+
+        if(cab != None):
+            self.assigned[cab] = passenger
+            self.unassigned.remove(passenger)
+            #The cab now picks the passenger up before its drop-offs
+            cab.replan()
+
+    def pickup(self, passenger):
+        cab = self.assignments.pop(passenger, None)
+        if(cab != None and self.assigned.get(cab) is passenger):
+            del self.assigned[cab]
+
+        self.unassigned.remove(passenger)
+
+ASSIGNMENTS = {
+    "greedy": greedy_assignment,
+    "optimal": optimal_assignment,
+}
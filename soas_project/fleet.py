@@ -0,0 +1,94 @@
+import numpy as np
+
+from .routing import RouteTable
+
+class Fleet:
+    #Struct-of-arrays state of all the cabs for the vectorized engine:
+    # position and destination as road cell indexes of a RouteTable,
+    # heading and odometer (road cost driven so far). Every tick all the
+    # cabs advance together with one next_hop gather per cell driven.
+    # The arrays are allocated for `capacity` cabs, and doubled when
+    # more are added; position, destination, heading and odometer are
+    # views of the slots in use
+    def __init__(self, routes, capacity=0):
+        if(not isinstance(routes, RouteTable)):
+            raise ValueError('The vectorized engine needs the routes in a RouteTable')
+
+        self.routes = routes
+        self.xy = np.array(routes.cells, dtype=np.int32).reshape(-1, 2)
+
+        self.size = 0
+        self.slots = {
+            "position": np.zeros(capacity, dtype=np.int32),
+            "destination": np.zeros(capacity, dtype=np.int32),
+            "heading": np.zeros((capacity, 2), dtype=np.int32),
+            "odometer": np.zeros(capacity, dtype=np.int64),
+        }
+        self.update_views()
+
+    def __len__(self):
+        return self.size
+
+    def update_views(self):
+        self.position = self.slots["position"][:self.size]
+        self.destination = self.slots["destination"][:self.size]
+        self.heading = self.slots["heading"][:self.size]
+        self.odometer = self.slots["odometer"][:self.size]
+
+    def add(self, pos, heading):
+        idx = self.routes.index[pos]
+
+        if(self.size == len(self.slots["position"])):
+            capacity = max(1, 2 * self.size)
+            for name, array in self.slots.items():
+                grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+                grown[:self.size] = array[:self.size]
+                self.slots[name] = grown
+
+        slot = self.size
+        self.slots["position"][slot] = idx
+        self.slots["destination"][slot] = idx
+        self.slots["heading"][slot] = heading
+        self.slots["odometer"][slot] = 0
+
+        self.size += 1
+        self.update_views()
+
+        return slot
+
+    def cell(self, idx):
+        return self.routes.cells[idx]
+
+    def advance(self, cells):
+        #Drive every cab up to `cells` cells towards its destination
+        moved = np.zeros(len(self.position), dtype=bool)
+        previous = self.position.copy()
+
+        for _ in range(cells):
+            moving = np.nonzero(self.position != self.destination)[0]
+            next_hop = self.routes.next_hop[self.position[moving], self.destination[moving]]
+
+            #Unreachable destinations (-1) stay where they are
+            moving = moving[next_hop >= 0]
+            next_hop = next_hop[next_hop >= 0]
+            if(len(moving) == 0):
+                break
+
+            previous[moving] = self.position[moving]
+            self.position[moving] = next_hop
+            self.odometer[moving] += self.routes.costs[next_hop]
+            moved[moving] = True
+
+        self.heading[moved] = self.xy[self.position[moved]] - self.xy[previous[moved]]
+
+        return int(moved.sum())
+
+    def nearest(self, pos, k, accept=None):
+        #Slots of the k cabs closest to pos by route distance, closest
+        # first, among the accepted slots (a boolean mask)
+        distance = self.routes.distance_matrix[self.position, self.routes.index[pos]].astype(np.int64)
+
+        candidates = np.nonzero((distance >= 0) & (accept if accept is not None else True))[0]
+        order = np.argsort(distance[candidates], kind="stable")[:k]
+
+        return candidates[order]
@@ -1,17 +1,25 @@
 import copy
+import heapq
 import math
 import random
 import statistics
+import time
 
+import numpy as np
 from mesa import Agent, Model
 from mesa.datacollection import DataCollector
 from mesa.space import MultiGrid
 from mesa.time import StagedActivation
 
-from .agents import Cab, Grass, Passenger
+from .agents import Cab, FleetCab, Passenger
+from .dispatch import ASSIGNMENTS, Dispatcher
+from .fleet import Fleet
+from .routing import CLOSED
+from .spatial import GridIndex, SightingTable
+from .utils import getBlockLayer, isConnected
 
 def get_average_perc_over_travelled_pool_passengers(model):
-    cabs = [a for a in model.schedule.agents if isinstance(a, Cab) and a.car_pooling and len(a.passengers) > 0]
+    cabs = [a for a in model.cabs if a.car_pooling and len(a.passengers) > 0]
     
     perc_values = []
 
@@ -29,37 +37,37 @@ def get_average_perc_over_travelled_pool_passengers(model):
     return median
 
 def get_count_passengers_not_pooling_travelling(model):
-    passengers = [len(a.passengers) for a in model.schedule.agents if isinstance(a, Cab) and not a.car_pooling and len(a.passengers) > 0]
+    passengers = [len(a.passengers) for a in model.cabs if not a.car_pooling and len(a.passengers) > 0]
 
     return sum(passengers)
 
 def get_count_passengers_pooling_travelling(model):
-    passengers = [len(a.passengers) for a in model.schedule.agents if isinstance(a, Cab) and a.car_pooling and len(a.passengers) > 0]
+    passengers = [len(a.passengers) for a in model.cabs if a.car_pooling and len(a.passengers) > 0]
 
     return sum(passengers)
 
 def get_count_passengers_travelling(model):
-    passengers = [len(a.passengers) for a in model.schedule.agents if isinstance(a, Cab)]
+    passengers = [len(a.passengers) for a in model.cabs]
 
     return sum(passengers)
 
 def get_count_cars_empty(model):
-    cabs = [a for a in model.schedule.agents if isinstance(a, Cab) and len(a.passengers) == 0]
+    cabs = [a for a in model.cabs if len(a.passengers) == 0]
 
     return len(cabs)
 
 def get_count_cars_carpooling(model):
-    cabs = [a for a in model.schedule.agents if isinstance(a, Cab) and a.car_pooling and len(a.passengers) > 0]
+    cabs = [a for a in model.cabs if a.car_pooling and len(a.passengers) > 0]
 
     return len(cabs)
 
 def get_count_cars_not_carpooling(model):
-    cabs = [a for a in model.schedule.agents if isinstance(a, Cab) and not a.car_pooling and len(a.passengers) > 0]
+    cabs = [a for a in model.cabs if not a.car_pooling and len(a.passengers) > 0]
 
     return len(cabs)
 
 def get_average_time_normal_passenger(model):
-    normal_passenger = [a.time_waiting for a in model.schedule.agents if isinstance(a, Passenger) and not a.isCarPooler]
+    normal_passenger = [a.time_waiting for a in model.passengers if not a.isCarPooler]
 
     if(len(normal_passenger) == 0):
         return 0
@@ -67,15 +75,26 @@ def get_average_time_normal_passenger(model):
     return sum(normal_passenger) / len(normal_passenger) 
 
 def get_average_time_pooling_passenger(model):
-    car_pooler = [a.time_waiting for a in model.schedule.agents if isinstance(a, Passenger) and a.isCarPooler]
+    car_pooler = [a.time_waiting for a in model.passengers if a.isCarPooler]
 
     if(len(car_pooler) == 0):
         return 0
 
     return sum(car_pooler) / len(car_pooler) 
 
+def get_dispatch_cpu_time(model):
+    #CPU time spent bidding and running the auction this tick, in ms
+    return model.dispatch_cpu_time * 1000
+
+def get_time(model):
+    return model.time
+
+def get_planned_distance(model):
+    #Distance the cabs still have to drive to drop all their riders
+    return sum(cab.plan.left(cab.odometer) for cab in model.cabs if not cab.is_empty)
+
 def get_average_time_all_passenger(model):
-    passengers = [a.time_waiting for a in model.schedule.agents if isinstance(a, Passenger)]
+    passengers = [a.time_waiting for a in model.passengers]
 
     if(len(passengers) == 0):
         return 0
@@ -83,8 +102,12 @@ def get_average_time_all_passenger(model):
     return sum(passengers) / len(passengers) 
 
 class CityModel(Model):
-    def __init__(self, N=2, PassengerPooling=.5, PassengerPopulation=.2, PassengerBlocks={}, width=20, height=10, city_map=[], roads={}, city_blocks=[], routes={}):
+    def __init__(self, N=2, PassengerPooling=.5, PassengerPopulation=.2, PassengerBlocks={}, width=20, height=10, city_map=[], roads={}, city_blocks=[], routes={}, CabSpeed=1, Assignment="greedy", DispatchInterval=1, DispatchThreshold=0, BidCandidates=0, Engine="tick", seed=None, MaxSeats=3, BidMode="distance", MaxDetour=.5, SightingRadius=1):
         super().__init__()
+        #Every random draw goes through these two seeded generators, so
+        # that runs with the same seed are repeatable
+        self.random = random.Random(seed)
+        self.np_random = np.random.default_rng(self.random.getrandbits(64))
         self.N = N    # num of cabs
         self.grid = MultiGrid(width, height, torus=False)
         
@@ -93,16 +116,91 @@ class CityModel(Model):
         self.schedule = StagedActivation(self, model_stages, shuffle=True)
         self.roads = roads
         self.routes = routes
+        self.routes_owned = False    # True once the model has its own copy to change
         self.passenger_blocks = PassengerBlocks
         self.unique_id_counter = 0
         self.city_blocks = city_blocks
+        #Blocks never move: they are a static layer instead of agents,
+        # so neither the schedule nor the grid queries go through them
+        self.blocks = getBlockLayer(city_blocks, width, height)
         self.passenger_population = PassengerPopulation
         self.passenger_pooling = PassengerPooling
-        self.max_seats = 3
+        self.max_seats = MaxSeats    # seats of a carpooling cab
+        self.cab_speed = CabSpeed    # cells a cab can drive per tick
+        self.closed_roads = {}    # closed road cell -> cost it had when open
+        self.open_roads = list(roads.keys())
+
+        #Registries of the agents by type, kept in schedule order, so no
+        # one has to scan the whole schedule to find them
+        self.cabs = []
+        self.passengers = {}    # passengers on the map, used as an ordered set
 
         #Bidding properties
         self.current_bidding_results = {}
         self.all_biddings = {}
+        self.assignment = ASSIGNMENTS[Assignment]    # engine matching the bids to cabs
+
+        #Dispatch windows: the auction runs every `dispatch_interval`
+        # ticks, or earlier once `dispatch_threshold` new passengers are
+        # waiting (0 disables the threshold)
+        self.dispatch_interval = DispatchInterval
+        self.dispatch_threshold = DispatchThreshold
+        self.ticks_since_dispatch = 0
+        self.new_passengers = 0
+        self.dispatching = True
+        self.dispatch_cpu_time = 0
+
+        #Canonical passenger -> cab table, shared by all the cabs
+        self.dispatcher = Dispatcher()
+
+        #With the "vector" engine the cabs state lives in the arrays of a
+        # Fleet and all the cabs drive at once after the agents steps
+        if(Engine not in ("tick", "vector", "event")):
+            raise ValueError(f'Unknown engine {Engine}')
+        self.fleet = Fleet(routes, N) if Engine == "vector" else None
+
+        #With the "event" engine every step jumps over the ticks where
+        # the cabs only drive and the passengers only wait, to the next
+        # tick where something happens (see skip_idle_ticks). It only
+        # pays off on sparse runs: with many cabs and passengers some
+        # cab has an event almost every tick, and the tick engine is as
+        # fast or faster
+        self.engine = Engine
+        self.time = 0    # ticks completed
+
+        #Event engine: heap of (tick, cab order) with the next event tick
+        # of every cab, and what each one was computed from. An entry is
+        # stale once the cab's destination, assignment or riders change,
+        # its tick has come or a new event cell lies on the cells where
+        # it starts the ticks before it
+        self.event_heap = []
+        self.cab_events = {}    # cab -> (state it was computed for, tick, cells)
+        self.event_cells_seen = set()    # event cells of the last search
+
+        #With BidCandidates set to k, a cab only bids for its k nearest
+        # unassigned passengers and the ones that have it among their k
+        # nearest free cabs. The cabs are then kept in a spatial index by
+        # position (the vectorized engine searches the Fleet arrays)
+        self.bid_candidates = BidCandidates
+        self.cab_index = GridIndex() if BidCandidates > 0 and self.fleet is None else None
+        self.nearest_cabs = None    # free cab -> passengers it is one of the nearest to, per auction
+        self.fleet_distances = None    # Fleet slot x waiting passenger distances, per auction
+
+        #Passengers seen from every road cell, up to `sighting_radius`
+        # cells away, in the order the grid lists its neighbors
+        self.sighting_radius = SightingRadius
+        self.sightings = SightingTable(PassengerBlocks.keys(), roads.keys(),
+                                       lambda cell: self.grid.get_neighborhood(cell, True, include_center=False,
+                                                                               radius=SightingRadius))
+
+        #Bids of the pooling cabs: "distance" only takes carpoolers next
+        # to the cab, "insertion" bids the extra distance of taking them
+        # along, as long as no rider travels more than `max_detour` over
+        # its direct distance
+        if(BidMode not in ("distance", "insertion")):
+            raise ValueError(f'Unknown bid mode {BidMode}')
+        self.bid_mode = BidMode
+        self.max_detour = MaxDetour
 
         
         self.datacollector = DataCollector(model_reporters={
@@ -115,9 +213,10 @@ class CityModel(Model):
                                            "Passengers Travelling (not pooling)": get_count_passengers_not_pooling_travelling,
                                            "Passengers Travelling (pooling)": get_count_passengers_pooling_travelling,
                                            "Passengers Travelling": get_count_passengers_travelling,
-                                           "Overtravelled (in percentage)": get_average_perc_over_travelled_pool_passengers})
-
-        self.fill_blocks_agents()
+                                           "Overtravelled (in percentage)": get_average_perc_over_travelled_pool_passengers,
+                                           "Dispatch CPU time (ms)": get_dispatch_cpu_time,
+                                           "Planned distance": get_planned_distance,
+                                           "Time": get_time})
 
         self.make_taxi_agents()
         self.addPassengers()
@@ -128,6 +227,18 @@ class CityModel(Model):
     def clear_biddings(self):
         self.current_bidding_results = None
         self.all_biddings = {}
+        self.nearest_cabs = None
+        self.fleet_distances = None
+
+    def update_dispatching(self):
+        self.ticks_since_dispatch = self.ticks_since_dispatch + 1
+
+        self.dispatching = self.ticks_since_dispatch >= self.dispatch_interval or \
+                           (self.dispatch_threshold > 0 and self.new_passengers >= self.dispatch_threshold)
+
+        if(self.dispatching):
+            self.ticks_since_dispatch = 0
+            self.new_passengers = 0
 
     def update_winners(self):
         #Check if it is the first time being called
@@ -137,87 +248,287 @@ class CityModel(Model):
             if (len(self.all_biddings) == 0):
                 return
         
-            passenger_assignment = {}
-
-            number_of_cabs_bidding = len(self.all_biddings)
-            first_cab = next(iter(self.all_biddings.keys()))
-
-            passengers_being_bidded = set()
+            start = time.process_time()
+            self.current_bidding_results = self.assignment(self.all_biddings)
 
-            for cab in self.all_biddings.keys():
-                for psg in self.all_biddings[cab].keys():
-                    passengers_being_bidded.add(psg)
+            for passenger, cab in self.current_bidding_results.items():
+                self.dispatcher.assign(passenger, cab)
+            self.dispatch_cpu_time += time.process_time() - start
 
-            number_of_passengers = len(passengers_being_bidded)
-
-            while(len(passenger_assignment) < number_of_cabs_bidding and len(passenger_assignment) < number_of_passengers):
-                passengers_all_distances = {}
-                passenger_assignment_temp = {}
-                for cab in self.all_biddings.keys():
-                    if (cab not in passenger_assignment.values()):
-                        for psg in passengers_being_bidded:
-                            if (psg not in passenger_assignment.keys()):
-                                cab_bidding_for_this_pass = psg in self.all_biddings[cab].keys()
-                                
-                                if(cab_bidding_for_this_pass):
-                                    pass_dist = self.all_biddings[cab][psg]
-                                else:
-                                    pass_dist = math.inf
-
-                                if(psg not in passengers_all_distances or passengers_all_distances[psg] > pass_dist):
-                                    passengers_all_distances[psg] = pass_dist
-                                    passenger_assignment_temp[psg] = cab if cab_bidding_for_this_pass else None
+    def bid(self, cab, passengers_offers):
+        self.all_biddings[cab] = passengers_offers
 
-                #order the passengers by the distance to the closest cab
-                passengers_all_distances = sorted(passengers_all_distances.items(), key=lambda kv: kv[1])
+    def waiting_distances(self):
+        #Route distances from every cab of the Fleet to every sighted
+        # passenger without a cab, gathered at once by the first cab
+        # bidding in an auction
+        if(self.fleet_distances is None):
+            access = [self.routes.index[p.road_access] for p in self.dispatcher.waiting]
+            self.fleet_distances = self.routes.distance_matrix[np.ix_(self.fleet.position, access)]
+
+        return self.fleet_distances
+
+    def nearest_passengers(self, cab, k):
+        #The k sighted passengers without a cab with the closest road
+        # access to the cab by route distance, and the ones that have the
+        # cab among their k nearest free cabs, so that the passengers far
+        # from every cab still get bids. The nearest cabs of every
+        # passenger are found once per auction, by the first cab asking
+        if(self.nearest_cabs is None):
+            self.nearest_cabs = {}
+            free_slots = {}
+            for passenger in self.dispatcher.waiting:
+                for near in self.nearest_free_cabs(passenger.road_access, k, passenger, free_slots):
+                    self.nearest_cabs.setdefault(near, []).append(passenger)
+
+        nearest = self.dispatcher.unassigned.nearest(cab.pos, k, lambda access: cab.get_distance(cab.pos, access))
+
+        return nearest + [p for p in self.nearest_cabs.get(cab, ()) if p not in nearest]
+
+    def nearest_free_cabs(self, pos, k, passenger=None, free_slots=None):
+        #The k cabs that can still bid for a passenger (or for this
+        # passenger) closest to pos by route distance. free_slots keeps
+        # the Fleet masks of free cabs between the calls of one auction
+        pooling = passenger is None or passenger.isCarPooler
+        if(pooling):
+            free = lambda cab: cab.has_free_seats and not cab.has_passenger_assigned
+        else:
+            free = lambda cab: cab.has_free_seats_normal and not cab.has_passenger_assigned
+
+        if(self.fleet is not None):
+            if(free_slots is None):
+                free_slots = {}
+            if(pooling not in free_slots):
+                free_slots[pooling] = np.array([free(cab) for cab in self.cabs], dtype=bool)
+
+            slots = self.fleet.nearest(pos, k, free_slots[pooling])
+            return [self.cabs[slot] for slot in slots]
+
+        distance = lambda cab_pos: 0 if cab_pos == pos else self.routes.distance(cab_pos, pos)
+        if(self.cab_index is None):
+            cabs = [cab for cab in self.cabs if free(cab) and distance(cab.pos) >= 0]
+            return sorted(cabs, key=lambda cab: distance(cab.pos))[:k]
+
+        return self.cab_index.nearest(pos, k, distance, free)
+
+    def close_road(self, pos):
+        #Closes a road cell at runtime: cabs can still leave it, but no
+        # route drives into it anymore. Only the routes that went
+        # through it are repaired.
+        if(not self.routes.supports_costs):
+            raise ValueError(f'{type(self.routes).__name__} routes do not support closing roads')
+
+        if(pos not in self.roads or pos in self.closed_roads):
+            raise ValueError(f'{pos} is not an open road')
+
+        if(pos in self.passenger_blocks.values()):
+            raise ValueError(f'{pos} is the road access of a passenger block')
+
+        if(not isConnected(self.roads, set(self.closed_roads.keys()) | {pos})):
+            raise ValueError(f'Closing {pos} would cut off part of the city')
+
+        self.own_routes()
+        self.closed_roads[pos] = self.routes.cost(pos)
+        self.routes.set_cost(pos, CLOSED)
+        self.open_roads.remove(pos)
+        self.reroute_cabs()
+
+    def reopen_road(self, pos):
+        if(pos not in self.closed_roads):
+            raise ValueError(f'{pos} is not a closed road')
+
+        self.routes.set_cost(pos, self.closed_roads.pop(pos))
+        self.open_roads = [p for p in self.roads.keys() if p not in self.closed_roads]
+        self.reroute_cabs()
+
+    def own_routes(self):
+        #The routes are shared with every model built on the same map
+        # (server resets, batch runs), so they are copied before the
+        # first change
+        if(not self.routes_owned):
+            self.routes = self.routes.copy()
+            self.routes_owned = True
+
+            if(self.fleet is not None):
+                self.fleet.routes = self.routes
+
+    def reroute_cabs(self):
+        #Drop the path segments planned on the old routes, and the
+        # random destinations that were closed
+        for cab in self.cabs:
+            cab.route_segment = []
+            cab.replan()
+            self.cab_events.pop(cab, None)
+
+            if(cab.destination in self.closed_roads):
+                cab.destination = cab.pos
 
-                #get the passenger who has the closest cab
-                passenger = passengers_all_distances[0][0]
-                #get the cab
-                cab = passenger_assignment_temp[passenger]
+    def make_taxi_agents(self):
+        for idx in self.np_random.integers(len(self.open_roads), size=self.N).tolist():
+            pos = self.open_roads[idx]
+
+            if(self.fleet is not None):
+                agent = FleetCab(self.unique_id_counter, self, pos, (1, 0))
+                self.schedule.add(agent)
+            else:
+                agent = Cab(self.unique_id_counter, self, pos, (1, 0))
+                self.schedule.add(agent)
+                self.grid.place_agent(agent, pos)
+                if(self.cab_index is not None):
+                    self.cab_index.add(agent, pos)
+
+            self.cabs.append(agent)
+            self.unique_id_counter = self.unique_id_counter + 1
 
-                passenger_assignment[passenger] = cab
+    def passengers_missing(self):
+        #True when addPassengers has spots to fill
+        return len(self.passengers) < len(self.passenger_blocks) and \
+               len(self.passengers)/len(self.passenger_blocks) < self.passenger_population
+
+    def ticks_to_event(self, cab, sighting_cells, carpool_cells):
+        #Ticks before the next tick in which the cab can do anything but
+        # drive on: it reaches its destination (drop-off, pickup or new
+        # destination), it starts a tick next to a passenger nobody has
+        # seen, or it is a carpooling cab with a free seat next to the
+        # road access of a waiting carpooler. 0 is the next tick. Also
+        # returns the cells where the cab starts the ticks before it
+        if(not (cab.car_pooling and cab.has_free_seats_car_pooling and not cab.has_passenger_assigned)):
+            carpool_cells = ()
+
+        speed = self.cab_speed
+        path = cab.path_ahead()
+        arrival = math.ceil((len(path) - 1) / speed)
+
+        for ticks in range(arrival):
+            pos = path[ticks * speed]
+            if(pos in sighting_cells or pos in carpool_cells):
+                return ticks, path[:ticks * speed:speed]
+
+        return arrival, path[:arrival * speed:speed]
+
+    def event_state(self, cab):
+        #What the next event of a cab depends on, besides the passengers
+        # it can see: where it goes, whom it picks up and its seats
+        return (cab.destination, cab.passenger_assigned, len(cab.passengers), cab.car_pooling)
+
+    def event_cells(self):
+        #Cells from where a passenger nobody has seen is in sight, and
+        # cells next to the road access of a waiting carpooler
+        sighting_cells = set()
+        for p in self.passengers:
+            if(p not in self.dispatcher):
+                sighting_cells.update(self.sightings.watchers(p.pos))
+
+        carpool_cells = set()
+        for access in {p.road_access for p in self.dispatcher.waiting if p.isCarPooler}:
+            carpool_cells.add(access)
+            for dx, dy in ((0, 1), (1, 0), (0, -1), (-1, 0)):
+                pos = (access[0] + dx, access[1] + dy)
+                if(pos in self.routes and pos != access and self.routes.distance(pos, access) == 1):
+                    carpool_cells.add(pos)
+
+        return sighting_cells, carpool_cells
+
+    def next_event(self):
+        #Next tick with an event for any cab. A free cab bids as long as
+        # a sighted passenger waits for one, and with insertion bids a
+        # pooling cab with a free seat as long as a carpooler waits
+        if(len(self.dispatcher.waiting) > 0):
+            carpooler = self.bid_mode == "insertion" and any(p.isCarPooler for p in self.dispatcher.waiting)
+            for cab in self.cabs:
+                if(not cab.has_passenger_assigned and
+                   (cab.has_free_seats_normal or (carpooler and cab.has_free_seats_car_pooling))):
+                    return self.time + 1
+
+        #A cab at its destination drops, picks up or draws a new one
+        for cab in self.cabs:
+            if(cab.pos == cab.destination):
+                return self.time + 1
+
+        #Passengers appearing and carpoolers starting to wait add event
+        # cells, and only the cabs starting a tick on one of them look
+        # again. Cells going away only put the events off, so the ticks
+        # already known stay safe
+        sighting_cells, carpool_cells = self.event_cells()
+        cells = sighting_cells | carpool_cells
+        added = cells - self.event_cells_seen
+        self.event_cells_seen = cells
+
+        #Cabs whose event tick is unknown or stale
+        stale = []
+        for order, cab in enumerate(self.cabs):
+            state, tick, path = self.cab_events.get(cab, (None, None, ()))
+            if(tick is None or tick <= self.time or state != self.event_state(cab) or not added.isdisjoint(path)):
+                stale.append((order, cab))
+                self.cab_events.pop(cab, None)
+
+        while(self.event_heap):
+            tick, order = self.event_heap[0]
+            event = self.cab_events.get(self.cabs[order])
+            if(event is not None and event[1] == tick):
+                break
+            heapq.heappop(self.event_heap)
+
+        for order, cab in stale:
+            ticks, path = self.ticks_to_event(cab, sighting_cells, carpool_cells)
+            tick = self.time + 1 + ticks
+            self.cab_events[cab] = (self.event_state(cab), tick, path)
+            heapq.heappush(self.event_heap, (tick, order))
+
+        return self.event_heap[0][0]
+
+    def skip_idle_ticks(self):
+        #Ticks before the next event change nothing but the cabs
+        # positions and the waiting times: drive all the cabs at once
+        # through them and keep the dispatch windows counting. The
+        # passengers of the next tick are added first, as the tick
+        # engine does before the cabs look around, so that a spawn is
+        # one more event cell instead of a tick that cannot be skipped
+        if(len(self.cabs) == 0):
+            return
 
-            self.current_bidding_results = passenger_assignment
+        self.addPassengers()
 
-    def bid(self, cab, passengers_offers):
-        self.all_biddings[cab] = passengers_offers
+        idle = self.next_event() - (self.time + 1)
+        if(idle <= 0):
+            return
 
-    def fill_blocks_agents(self):
-        for block in self.city_blocks:
-            agent = Grass(self.unique_id_counter, self, block[0], block[1])
-            self.schedule.add(agent)
-            self.grid.place_agent(agent, block[0])
+        for _ in range(idle):
+            self.update_dispatching()
 
-            self.unique_id_counter = self.unique_id_counter + 1
+        for cab in self.cabs:
+            cab.drive(idle * self.cab_speed)
 
-    def make_taxi_agents(self):
-        r = random.SystemRandom()
-        for _ in range(self.N):
-            possible_places = list(self.roads.keys())
-            r.shuffle(possible_places)
-            pos = possible_places[0]
-
-            agent = Cab(self.unique_id_counter, self, pos, (1, 0))
-            self.schedule.add(agent)
-            self.grid.place_agent(agent, pos)
-            self.unique_id_counter = self.unique_id_counter + 1
+        self.time = self.time + idle
 
     def step(self):
+        if(self.engine == "event"):
+            self.skip_idle_ticks()
 
         self.addPassengers()
         
         self.clear_biddings()
+        self.update_dispatching()
+        self.dispatch_cpu_time = 0
 
+        self.time = self.time + 1
         self.schedule.step()
+
+        if(self.fleet is not None):
+            self.fleet.advance(self.cab_speed)
+
         self.datacollector.collect(self)
 
     def addPassengers(self):
-        passengers_waiting = [agent.pos for agent in self.schedule.agents if isinstance(agent, Passenger)]
+        #Nothing is drawn on the ticks without spots to fill, so that the
+        # event engine can skip them
+        if(not self.passengers_missing()):
+            return
+
+        passengers_waiting = [agent.pos for agent in self.passengers]
         
         free_spot = list(set(self.passenger_blocks.keys()) - set(passengers_waiting))
-        r = random.SystemRandom()
-        r.shuffle(free_spot)
+        self.random.shuffle(free_spot)
 
         destinations = set(self.passenger_blocks.keys())
 
@@ -234,11 +545,14 @@ class CityModel(Model):
             while(self.passenger_blocks[destination] == self.passenger_blocks[pos]):
                 destination = self.random.choice(possible_destinations)
 
-            isCarPooler = random.random() < self.passenger_pooling
+            isCarPooler = self.random.random() < self.passenger_pooling
             passenger = Passenger(self.unique_id_counter, self, pos, self.passenger_blocks[destination], self.passenger_blocks[pos], isCarPooler)
             self.schedule.add(passenger)
+            self.passengers[passenger] = None
             
             self.grid.place_agent(passenger, pos)
+            self.sightings.add(passenger)
             self.unique_id_counter = self.unique_id_counter + 1
+            self.new_passengers = self.new_passengers + 1
 
             passengers_waiting.append(pos)
@@ -0,0 +1,211 @@
+import math
+from itertools import permutations
+
+#Up to this many stops the drop-off order is exact (Held-Karp), above
+# it the cheapest insertion heuristic is used
+EXACT_STOPS = 8
+
+def leg_matrix(start, stops, distance):
+    #Distances between every pair of points of [start] + stops, each leg
+    # computed once and shared by every candidate order
+    points = [start] + list(stops)
+
+    return [[distance(a, b) for b in points] for a in points]
+
+def route_length(legs, order):
+    #Length of the path from the start through the stops in order
+    # (stop indexes start at 0, the start is point 0 of legs)
+    length = 0
+    previous = 0
+    for stop in order:
+        length += legs[previous][stop + 1]
+        previous = stop + 1
+
+    return length
+
+def permutation_order(legs):
+    #Tries every order of the stops. Kept as the reference for the
+    # other orderings; the first shortest order found is returned
+    best_order = None
+    min_dist = None
+    for order in permutations(range(len(legs) - 1)):
+        total_dist = route_length(legs, order)
+
+        if(min_dist == None or total_dist < min_dist):
+            min_dist = total_dist
+            best_order = order
+
+    return list(best_order)
+
+def held_karp_order(legs):
+    #Shortest order of the stops by dynamic programming over the subsets
+    # of visited stops, in O(2^n n^2). Among the shortest orders it picks
+    # the same one as permutation_order, the first in lexicographic order
+    n = len(legs) - 1
+    full = (1 << n) - 1
+
+    #to_go[visited][last]: shortest way to visit the stops left after
+    # the stops in `visited`, starting from `last`
+    to_go = [None] * (full + 1)
+    to_go[full] = [0] * n
+
+    for visited in range(full - 1, 0, -1):
+        row = [None] * n
+        for last in range(n):
+            if(visited >> last & 1):
+                row[last] = min(legs[last + 1][stop + 1] + to_go[visited | 1 << stop][stop]
+                                for stop in range(n) if not visited >> stop & 1)
+        to_go[visited] = row
+
+    order = []
+    visited = 0
+    previous = -1
+    while(visited != full):
+        candidates = [(legs[previous + 1][stop + 1] + to_go[visited | 1 << stop][stop], stop)
+                      for stop in range(n) if not visited >> stop & 1]
+        _, stop = min(candidates)
+
+        order.append(stop)
+        visited |= 1 << stop
+        previous = stop
+
+    return order
+
+def insertion_order(legs):
+    #Builds the order inserting every stop where it makes the path
+    # shortest, in O(n^2)
+    order = []
+    for stop in range(len(legs) - 1):
+        best = None
+        for at in range(len(order) + 1):
+            previous = order[at - 1] + 1 if at > 0 else 0
+            added = legs[previous][stop + 1]
+
+            if(at < len(order)):
+                added += legs[stop + 1][order[at] + 1] - legs[previous][order[at] + 1]
+
+            if(best is None or added < best[0]):
+                best = (added, at)
+
+        order.insert(best[1], stop)
+
+    return order
+
+def order_stops(start, stops, distance):
+    #Order (indexes into stops) in which to visit the stops from start
+    legs = leg_matrix(start, stops, distance)
+
+    if(len(stops) <= EXACT_STOPS):
+        return held_karp_order(legs)
+
+    return insertion_order(legs)
+
+def plan_arrivals(start, stops, distance):
+    #Distance driven from start to reach every stop, visiting them in order
+    arrivals = []
+    driven = 0
+    previous = start
+    for stop in stops:
+        driven += distance(previous, stop)
+        arrivals.append(driven)
+        previous = stop
+
+    return arrivals
+
+class Plan:
+    #Drop-off plan of a cab, made once from where the cab is: the stops
+    # in order, the odometer reading at which each one is reached and
+    # the tick it is reached at, driving `speed` cells per tick.
+    # hops(pos1, pos2) counts the cells of a route, and defaults to the
+    # distance for maps where every road costs 1. A cab only drives
+    # shortest routes, so the plan stays right until its stops change.
+    # `via` is a pickup the cab goes to first
+    def __init__(self, start, stops, distance, odometer=0, time=0, speed=1, via=None, hops=None):
+        self.stops = list(stops)
+        points = self.stops if via is None else [via] + self.stops
+
+        arrivals = plan_arrivals(start, points, distance)
+        cells = arrivals if hops is None else plan_arrivals(start, points, hops)
+
+        #A cab stops at every stop and drives on the next tick, so every
+        # leg starts a new tick
+        etas = []
+        ticks = time
+        for driven, previous in zip(cells, [0] + cells):
+            ticks += math.ceil((driven - previous) / speed)
+            etas.append(ticks)
+
+        skipped = len(points) - len(self.stops)
+        self.odometers = [odometer + arrival for arrival in arrivals[skipped:]]
+        self.etas = etas[skipped:]
+
+    def __len__(self):
+        return len(self.stops)
+
+    def left(self, odometer, idx=-1):
+        #Distance still to drive, at the given odometer reading, to reach
+        # stops[idx] (the last stop by default)
+        if(len(self.stops) == 0):
+            return 0
+
+        return self.odometers[idx] - odometer
+
+    def drop_first(self):
+        #The rest of the plan once its first stop is reached
+        self.stops.pop(0)
+        self.odometers.pop(0)
+        self.etas.pop(0)
+
+def insertion_cost(start, stops, pickup, dropoff, distance, slack=None, max_ride=None):
+    #Cheapest way to add a passenger to a plan, in O(k) for k stops. A
+    # cab drives to a passenger as soon as it gets it, so the pickup goes
+    # before the stops and only the drop-off position is searched.
+    # slack[j] is how much later stops[j] may be reached and max_ride the
+    # longest ride of the new passenger (None for no limit). Returns
+    # (added route length, index of the drop-off in stops), or None when
+    # no position keeps within the limits
+    to_pickup = distance(start, pickup)
+    if(len(stops) == 0):
+        ride = distance(pickup, dropoff)
+        if(max_ride is not None and ride > max_ride):
+            return None
+
+        return (to_pickup + ride, 0)
+
+    first_leg = distance(pickup, stops[0])
+    #Every stop is reached this much later because of the pickup
+    delay = to_pickup + first_leg - distance(start, stops[0])
+
+    #Least slack of the stops from j on
+    min_slack_after = [math.inf] * (len(stops) + 1)
+    if(slack is not None):
+        for j in range(len(stops) - 1, -1, -1):
+            min_slack_after[j] = min(slack[j], min_slack_after[j + 1])
+
+    best = None
+    ride_before = 0    # distance from the pickup to the stop before the drop-off
+    for at in range(len(stops) + 1):
+        #The stops before the drop-off are only delayed by the pickup
+        if(at > 0 and slack is not None and slack[at - 1] < delay):
+            break
+
+        previous = pickup if at == 0 else stops[at - 1]
+        if(at > 0):
+            ride_before += first_leg if at == 1 else distance(stops[at - 2], previous)
+
+        to_dropoff = distance(previous, dropoff)
+        added = delay + to_dropoff
+        if(at < len(stops)):
+            leg = first_leg if at == 0 else distance(previous, stops[at])
+            added += distance(dropoff, stops[at]) - leg
+
+            if(min_slack_after[at] < added):
+                continue
+
+        if(max_ride is not None and ride_before + to_dropoff > max_ride):
+            continue
+
+        if(best is None or added < best[0]):
+            best = (added, at)
+
+    return best
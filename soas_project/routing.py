@@ -0,0 +1,545 @@
+import copy
+import os
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from heapq import heappop, heappush
+
+import numpy as np
+
+
+#Cost of a closed road: cabs can leave it but not drive into it
+CLOSED = -1
+
+def dijkstra_tree(incoming, costs, idx_to):
+    #Shortest-path tree towards idx_to on the weighted road graph, where
+    # driving into cell j costs costs[j] and incoming[j] lists the cells
+    # with a road into j. Returns the distance and next hop of every
+    # cell as lists, -1 when the cell cannot reach idx_to.
+    distance = [-1] * len(incoming)
+    next_hop = [-1] * len(incoming)
+    distance[idx_to] = 0
+    next_hop[idx_to] = idx_to
+
+    done = [False] * len(incoming)
+    heap = [(0, idx_to)]
+    while heap:
+        dist, vertex = heappop(heap)
+        if done[vertex]:
+            continue
+        done[vertex] = True
+
+        if costs[vertex] == CLOSED:
+            continue
+
+        dist_through = dist + costs[vertex]
+        for neighbor in incoming[vertex]:
+            if not done[neighbor] and (distance[neighbor] < 0 or dist_through < distance[neighbor]):
+                distance[neighbor] = dist_through
+                next_hop[neighbor] = vertex
+                heappush(heap, (dist_through, neighbor))
+
+    return distance, next_hop
+
+def getIncoming(neighbors):
+    #Reverse adjacency of a padded out-neighbor array
+    incoming = [[] for _ in range(len(neighbors))]
+    for idx, row in enumerate(neighbors.tolist()):
+        for neighbor in row:
+            if neighbor >= 0:
+                incoming[neighbor].append(idx)
+
+    return incoming
+
+class RouteRow:
+    #Read-only view of the routes from one road cell, so the
+    # old routes[pos1][pos2]["next_pos"] access keeps working
+    def __init__(self, table, pos_from):
+        self.table = table
+        self.pos_from = pos_from
+
+    def __contains__(self, pos):
+        return pos in self.table and self.table.distance(self.pos_from, pos) >= 0
+
+    def __getitem__(self, pos):
+        return {"next_pos": self.table.next_pos(self.pos_from, pos),
+                "distance": self.table.distance(self.pos_from, pos)}
+
+class Routes(ABC):
+    #Common interface of the routes providers. Subclasses implement
+    # keys(), distance() and next_pos(); the routes[pos1][pos2] access
+    # and the path segments are built on top of them.
+    @abstractmethod
+    def keys(self):
+        #Road cells with routes
+        pass
+
+    @abstractmethod
+    def distance(self, pos1, pos2):
+        #Route distance from pos1 to pos2, -1 when there is no route
+        pass
+
+    @abstractmethod
+    def next_pos(self, pos1, pos2):
+        #Next cell on the route from pos1 to pos2
+        pass
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __contains__(self, pos):
+        return pos in self.keys()
+
+    def __getitem__(self, pos):
+        if(pos not in self):
+            raise KeyError(pos)
+
+        return RouteRow(self, pos)
+
+    #Whether every open road costs 1, so distances count cells
+    unit_costs = True
+
+    def cost(self, pos):
+        #Cost of driving into pos
+        return 1
+
+    def hops(self, pos1, pos2):
+        #Number of cells driven on the route from pos1 to pos2
+        if(self.unit_costs):
+            return self.distance(pos1, pos2)
+
+        hops = 0
+        while(pos1 != pos2):
+            pos1 = self.next_pos(pos1, pos2)
+            hops += 1
+
+        return hops
+
+    #Whether set_cost can change the roads costs at runtime
+    supports_costs = False
+
+    def set_cost(self, pos, cost):
+        raise NotImplementedError(f'{type(self).__name__} does not support changing road costs')
+
+    def copy(self):
+        #Routes that can be changed without touching these ones. Only
+        # needed by the providers that support set_cost
+        raise NotImplementedError(f'{type(self).__name__} does not support copying')
+
+    def segment(self, pos, destination):
+        #Cells of the shortest path from pos (excluded) to the end of
+        # the current straight run of road, or to the destination if
+        # it comes first. Cabs consume it without further lookups.
+        cells = []
+        heading = None
+
+        while pos != destination:
+            next_pos = self.next_pos(pos, destination)
+            next_heading = (next_pos[0] - pos[0], next_pos[1] - pos[1])
+
+            if(heading is not None and next_heading != heading):
+                break
+
+            cells.append(next_pos)
+            heading = next_heading
+            pos = next_pos
+
+        return cells
+
+class RouteTable(Routes):
+    #Dense routing table: every road cell gets an integer index and
+    # distance[i, j] / next_hop[i, j] hold the shortest distance from
+    # cell i to cell j and the index of the next cell on that path.
+    # Unreachable pairs are stored as -1. neighbors[i] are the cells
+    # reachable from i in one move (padded with -1) and costs[i] is the
+    # cost of driving into i, which set_cost can change at runtime.
+    def __init__(self, cells, distance, next_hop, neighbors, costs=None):
+        self.cells = [tuple(int(c) for c in cell) for cell in cells]
+        self.index = {pos: idx for idx, pos in enumerate(self.cells)}
+        self.distance_matrix = distance
+        self.next_hop = next_hop
+        self.neighbors = neighbors
+        self.costs = costs if costs is not None else np.ones(len(self.cells), dtype=np.int32)
+        self.unit_costs = bool(np.isin(self.costs, (1, CLOSED)).all())
+        self.incoming = None
+
+    supports_costs = True
+
+    def keys(self):
+        return self.index.keys()
+
+    @property
+    def nbytes(self):
+        return self.distance_matrix.nbytes + self.next_hop.nbytes
+
+    def copy(self):
+        #The neighbors never change and are shared, the tables are copied
+        routes = RouteTable(self.cells, np.array(self.distance_matrix), np.array(self.next_hop),
+                            self.neighbors, np.array(self.costs))
+        routes.incoming = self.incoming
+
+        return routes
+
+    def is_connected(self):
+        #Every road reaches every other when the first road reaches all
+        # of them and all of them reach it
+        if(len(self.cells) == 0):
+            return True
+
+        return bool((self.distance_matrix[0] >= 0).all() and (self.distance_matrix[:, 0] >= 0).all())
+
+    def distance(self, pos1, pos2):
+        return self.distance_matrix.item(self.index[pos1], self.index[pos2])
+
+    def next_pos(self, pos1, pos2):
+        next_hop = self.next_hop.item(self.index[pos1], self.index[pos2])
+        if(next_hop < 0):
+            raise ValueError(f'There is no route from {pos1} to {pos2}')
+
+        return self.cells[next_hop]
+
+    def cost(self, pos):
+        return self.costs.item(self.index[pos])
+
+    def make_writable(self):
+        #Tables loaded read-only from the route cache are copied on
+        # the first change
+        if(self.incoming is None):
+            self.incoming = getIncoming(self.neighbors)
+
+        if(not self.distance_matrix.flags.writeable):
+            self.distance_matrix = np.array(self.distance_matrix)
+            self.next_hop = np.array(self.next_hop)
+
+        if(not self.costs.flags.writeable):
+            self.costs = np.array(self.costs)
+
+    def repair_column(self, idx_to, idx, raised, costs):
+        #Repairs the tree towards idx_to after the cost of driving into
+        # idx changed, touching only the cells whose route changes
+        distance = self.distance_matrix[:, idx_to].tolist()
+        next_hop = self.next_hop[:, idx_to].tolist()
+        heap = []
+
+        if(raised):
+            #Cells whose route went through idx lose it and look for
+            # the best way out through the rest of the tree
+            lost = set()
+            stack = [idx]
+            while stack:
+                vertex = stack.pop()
+                for neighbor in self.incoming[vertex]:
+                    if next_hop[neighbor] == vertex and neighbor not in lost:
+                        lost.add(neighbor)
+                        stack.append(neighbor)
+
+            for vertex in lost:
+                distance[vertex] = -1
+                next_hop[vertex] = -1
+
+            for vertex in lost:
+                for neighbor in self.neighbors[vertex].tolist():
+                    if neighbor >= 0 and neighbor not in lost and distance[neighbor] >= 0 and costs[neighbor] != CLOSED:
+                        dist_through = distance[neighbor] + costs[neighbor]
+                        if distance[vertex] < 0 or dist_through < distance[vertex]:
+                            distance[vertex] = dist_through
+                            next_hop[vertex] = neighbor
+
+                if distance[vertex] >= 0:
+                    heappush(heap, (distance[vertex], vertex))
+        else:
+            #Cells leading into idx may now be better off through it
+            dist_through = distance[idx] + costs[idx]
+            for neighbor in self.incoming[idx]:
+                if distance[idx] >= 0 and (distance[neighbor] < 0 or dist_through < distance[neighbor]):
+                    distance[neighbor] = dist_through
+                    next_hop[neighbor] = idx
+                    heappush(heap, (dist_through, neighbor))
+
+        #Propagate the new distances backwards, as Dijkstra does
+        while heap:
+            dist, vertex = heappop(heap)
+            if dist != distance[vertex] or costs[vertex] == CLOSED:
+                continue
+
+            dist_through = dist + costs[vertex]
+            for neighbor in self.incoming[vertex]:
+                if distance[neighbor] < 0 or dist_through < distance[neighbor]:
+                    distance[neighbor] = dist_through
+                    next_hop[neighbor] = vertex
+                    heappush(heap, (dist_through, neighbor))
+
+        if(max(distance) > np.iinfo(self.distance_matrix.dtype).max):
+            self.distance_matrix = self.distance_matrix.astype(np.int32)
+
+        self.distance_matrix[:, idx_to] = distance
+        self.next_hop[:, idx_to] = next_hop
+
+    def set_cost(self, pos, cost):
+        #Changes the cost of driving into pos (CLOSED to close the road)
+        # and repairs only the trees that can change, returning how many
+        # of them were touched
+        idx = self.index[pos]
+        old_cost = self.costs.item(idx)
+        if(cost == old_cost):
+            return 0
+
+        self.make_writable()
+        self.costs[idx] = cost
+        self.unit_costs = bool(np.isin(self.costs, (1, CLOSED)).all())
+        costs = self.costs.tolist()
+        raised = cost == CLOSED or (old_cost != CLOSED and cost > old_cost)
+
+        if(cost == CLOSED or old_cost == CLOSED):
+            distance, next_hop = dijkstra_tree(self.incoming, costs, idx)
+            column = np.array(distance, dtype=np.int64)
+            self.next_hop[:, idx] = next_hop
+        else:
+            #Every route towards pos ends driving into it, so its tree
+            # keeps its shape and only shifts
+            column = self.distance_matrix[:, idx].astype(np.int64)
+            column[column > 0] += cost - old_cost
+
+        if(column.max() > np.iinfo(self.distance_matrix.dtype).max):
+            self.distance_matrix = self.distance_matrix.astype(np.int32)
+        self.distance_matrix[:, idx] = column
+
+        #A higher cost only matters to the trees where some cell drives
+        # into pos, and a lower one to those where driving through pos
+        # now beats the current distance of a cell leading into it
+        incoming = self.incoming[idx]
+        if(raised):
+            affected = (self.next_hop[incoming] == idx).any(axis=0)
+        else:
+            affected = np.zeros(len(self.cells), dtype=bool)
+            through = self.distance_matrix[idx].astype(np.int64) + cost
+            reachable = self.distance_matrix[idx] >= 0
+            for neighbor in incoming:
+                current = self.distance_matrix[neighbor]
+                affected |= reachable & ((current < 0) | (through < current))
+        affected[idx] = False
+
+        columns = np.nonzero(affected)[0].tolist()
+        for idx_to in columns:
+            self.repair_column(idx_to, idx, raised, costs)
+
+        return len(columns) + 1
+
+    def segment(self, pos, destination):
+        #Same as Routes.segment, walking the next hop matrix by index
+        idx = self.index[pos]
+        idx_to = self.index[destination]
+        cells = []
+        heading = None
+
+        while idx != idx_to:
+            idx_next = self.next_hop.item(idx, idx_to)
+            if(idx_next < 0):
+                raise ValueError(f'There is no route from {pos} to {destination}')
+
+            pos_next = self.cells[idx_next]
+            next_heading = (pos_next[0] - pos[0], pos_next[1] - pos[1])
+
+            if(heading is not None and next_heading != heading):
+                break
+
+            cells.append(pos_next)
+            heading = next_heading
+            idx = idx_next
+            pos = pos_next
+
+        return cells
+
+    def save(self, directory):
+        np.save(os.path.join(directory, "cells.npy"), np.array(self.cells, dtype=np.int32).reshape(-1, 2))
+        np.save(os.path.join(directory, "distance.npy"), self.distance_matrix)
+        np.save(os.path.join(directory, "next_hop.npy"), self.next_hop)
+        np.save(os.path.join(directory, "neighbors.npy"), self.neighbors)
+        np.save(os.path.join(directory, "costs.npy"), self.costs)
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        #With mmap_mode the matrices are only mapped, not read, so
+        # loading is immediate and pages are shared by the OS
+        cells = np.load(os.path.join(directory, "cells.npy"))
+        distance = np.load(os.path.join(directory, "distance.npy"), mmap_mode=mmap_mode)
+        next_hop = np.load(os.path.join(directory, "next_hop.npy"), mmap_mode=mmap_mode)
+        neighbors = np.load(os.path.join(directory, "neighbors.npy"))
+        costs = np.load(os.path.join(directory, "costs.npy"))
+
+        return cls(cells.tolist(), distance, next_hop, neighbors, costs)
+
+class LazyRouteTable(Routes):
+    #Routes computed on demand for maps too big for an all-pairs table.
+    # The first query towards a destination runs one BFS rooted at it
+    # and keeps the resulting shortest-path tree (distance and next hop
+    # of every road cell); the least recently used trees are evicted
+    # once they take more than max_bytes. With road costs the trees are
+    # built with Dijkstra instead of BFS.
+    def __init__(self, city_roads, costs=None, max_bytes=64 * 2**20):
+        self.cells = list(city_roads.keys())
+        self.index = {pos: idx for idx, pos in enumerate(self.cells)}
+        self.costs = [costs.get(pos, 1) for pos in self.cells] if costs else None
+        self.unit_costs = self.costs is None or all(cost in (1, CLOSED) for cost in self.costs)
+
+        #BFS and Dijkstra walk the roads backwards, from the destination
+        self.incoming = [[] for _ in self.cells]
+        for pos in self.cells:
+            for neighbor in sorted(city_roads[pos]):
+                self.incoming[self.index[neighbor]].append(self.index[pos])
+
+        tree_bytes = 2 * len(self.cells) * np.dtype(np.int32).itemsize
+        self.max_trees = max(1, max_bytes // max(1, tree_bytes))
+        self.trees = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def keys(self):
+        return self.index.keys()
+
+    @property
+    def nbytes(self):
+        return sum(distance.nbytes + next_hop.nbytes for distance, next_hop in self.trees.values())
+
+    supports_costs = True
+
+    def cost(self, pos):
+        return self.costs[self.index[pos]] if self.costs else 1
+
+    def copy(self):
+        #The cached trees are replaced, never changed, so they are shared
+        routes = copy.copy(self)
+        routes.costs = list(self.costs) if self.costs else None
+        routes.trees = OrderedDict(self.trees)
+
+        return routes
+
+    def set_cost(self, pos, cost):
+        #Cached trees may all depend on the cost, start over
+        if(self.costs is None):
+            self.costs = [1] * len(self.cells)
+
+        self.costs[self.index[pos]] = cost
+        self.unit_costs = all(cost in (1, CLOSED) for cost in self.costs)
+        self.trees.clear()
+
+    def build_tree(self, idx_to):
+        if(self.costs):
+            distance, next_hop = dijkstra_tree(self.incoming, self.costs, idx_to)
+            return np.array(distance, dtype=np.int32), np.array(next_hop, dtype=np.int32)
+
+        distance = [-1] * len(self.cells)
+        next_hop = [-1] * len(self.cells)
+        distance[idx_to] = 0
+        next_hop[idx_to] = idx_to
+
+        queue = deque([idx_to])
+        while queue:
+            vertex = queue.popleft()
+            for neighbor in self.incoming[vertex]:
+                if distance[neighbor] < 0:
+                    distance[neighbor] = distance[vertex] + 1
+                    next_hop[neighbor] = vertex
+                    queue.append(neighbor)
+
+        return np.array(distance, dtype=np.int32), np.array(next_hop, dtype=np.int32)
+
+    def tree(self, pos_to):
+        idx_to = self.index[pos_to]
+        tree = self.trees.get(idx_to)
+
+        if(tree is not None):
+            self.hits += 1
+            self.trees.move_to_end(idx_to)
+            return tree
+
+        self.misses += 1
+        tree = self.build_tree(idx_to)
+        self.trees[idx_to] = tree
+
+        if(len(self.trees) > self.max_trees):
+            self.trees.popitem(last=False)
+
+        return tree
+
+    def distance(self, pos1, pos2):
+        distance, _ = self.tree(pos2)
+
+        return distance.item(self.index[pos1])
+
+    def next_pos(self, pos1, pos2):
+        _, next_hop = self.tree(pos2)
+
+        next_hop = next_hop.item(self.index[pos1])
+        if(next_hop < 0):
+            raise ValueError(f'There is no route from {pos1} to {pos2}')
+
+        return self.cells[next_hop]
+
+class GridRouteTable(Routes):
+    #Routes of a regular Manhattan grid, where the roads are exactly the
+    # full lines x in lines_x and y in lines_y, the outermost lines
+    # enclose the map and no two lines are next to each other.
+    # Distances are answered analytically from the block coordinates,
+    # so nothing grows with the number of pairs.
+    def __init__(self, city_roads, lines_x, lines_y):
+        self.roads = city_roads
+        self.lines_x = sorted(lines_x)
+        self.lines_y = sorted(lines_y)
+        self.set_x = set(lines_x)
+        self.set_y = set(lines_y)
+
+    def keys(self):
+        return self.roads.keys()
+
+    @property
+    def nbytes(self):
+        return 0
+
+    @staticmethod
+    def span(lines, value):
+        #Lines enclosing a coordinate that is not on a line
+        idx = bisect_left(lines, value)
+
+        return lines[idx - 1], lines[idx]
+
+    @staticmethod
+    def corridor_distance(lines, lines_set, a1, a2, b1, b2):
+        #Distance between two cells on lines parallel to the a axis.
+        # It is only longer than Manhattan when both cells are off the
+        # crossing lines and inside the same span, and have to go around
+        # through one of the two lines enclosing it.
+        if(b1 == b2 or a1 in lines_set or a2 in lines_set):
+            return None
+
+        low, high = GridRouteTable.span(lines, a1)
+        if(not low < a2 < high):
+            return None
+
+        return abs(b1 - b2) + min((a1 - low) + (a2 - low), (high - a1) + (high - a2))
+
+    def distance(self, pos1, pos2):
+        (x1, y1), (x2, y2) = pos1, pos2
+
+        if(y1 in self.set_y and y2 in self.set_y):
+            distance = self.corridor_distance(self.lines_x, self.set_x, x1, x2, y1, y2)
+            if(distance is not None):
+                return distance
+
+        if(x1 in self.set_x and x2 in self.set_x):
+            distance = self.corridor_distance(self.lines_y, self.set_y, y1, y2, x1, x2)
+            if(distance is not None):
+                return distance
+
+        return abs(x1 - x2) + abs(y1 - y2)
+
+    def next_pos(self, pos1, pos2):
+        #First road neighbor one step closer to the destination
+        distance = self.distance(pos1, pos2)
+
+        for neighbor in sorted(self.roads[pos1]):
+            if(self.distance(neighbor, pos2) == distance - 1):
+                return neighbor
+
+        return pos1
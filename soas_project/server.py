@@ -1,10 +1,12 @@
+from collections import defaultdict
+
 from mesa.visualization.ModularVisualization import ModularServer
 from mesa.visualization.modules import CanvasGrid, ChartModule, BarChartModule
 from mesa.visualization.UserParam import UserSettableParameter
 
-from .agents import Cab, Grass, Passenger
+from .agents import Cab, Passenger
 from .model import CityModel
-from .utils import getRoads
+from .utils import BLOCK_CENTER, loadCityMap
 
 
 def agent_draw(agent):
@@ -38,19 +40,6 @@ def agent_draw(agent):
             "text_color": "red",
             "scale": .9
         }
-    elif isinstance(agent, Grass):
-        color =  ["#808080", "#8c8c8c", "#999999"]
-        if (agent.isBlockCenter):
-            color = ["#00FF00", "#00CC00", "#009900"]
-
-        portrayal = {
-            "Shape": "rect",
-            "Filled": "true",
-            "Layer": 0,
-            "Color": color,
-            "w": 1,
-            "h": 1
-        }
     elif isinstance(agent, Cab):
         icon = "resources/images/taxi_yellow.png"
         
@@ -68,6 +57,10 @@ def agent_draw(agent):
             "text_color": "red",
             "scale": 0.8
         }
+
+        #Riders, and ticks until the last of them is dropped
+        if(not agent.is_empty):
+            portrayal["text"] = f'{len(agent.passengers)}:{agent.plan.etas[-1] - agent.model.time}'
     else:
         portrayal = {
             "Shape": "rect",
@@ -80,15 +73,50 @@ def agent_draw(agent):
 
     return portrayal
 
-def launch_city_model():
-    city_map = []
+def block_draw(block):
+    color =  ["#808080", "#8c8c8c", "#999999"]
+    if (block == BLOCK_CENTER):
+        color = ["#00FF00", "#00CC00", "#009900"]
+
+    return {
+        "Shape": "rect",
+        "Filled": "true",
+        "Layer": 0,
+        "Color": color,
+        "w": 1,
+        "h": 1
+    }
+
+class CityCanvasGrid(CanvasGrid):
+    #Draws the moving agents from the schedule and the blocks from the
+    # model's static block layer, whose portrayals are built only once
+    def __init__(self, portrayal_method, grid_width, grid_height, canvas_width=500, canvas_height=500):
+        super().__init__(portrayal_method, grid_width, grid_height, canvas_width, canvas_height)
+        self.block_portrayals = None
+
+    def render(self, model):
+        if(self.block_portrayals is None):
+            self.block_portrayals = []
+            for x, y in zip(*model.blocks.nonzero()):
+                portrayal = block_draw(model.blocks[x, y])
+                portrayal["x"] = int(x)
+                portrayal["y"] = int(y)
+                self.block_portrayals.append(portrayal)
+
+        grid_state = defaultdict(list)
+        grid_state[0] = list(self.block_portrayals)
+
+        for agent in model.schedule.agents:
+            portrayal = self.portrayal_method(agent)
+            if portrayal:
+                portrayal["x"] = agent.pos[0]
+                portrayal["y"] = agent.pos[1]
+                grid_state[portrayal["Layer"]].append(portrayal)
+
+        return grid_state
 
-    with open("city_map_21x21.txt","r") as f:
-        for line in f:
-            l = []
-            for cell in line.strip().split('\t'):
-                l.append(cell)
-            city_map.append(l)
+def launch_city_model():
+    city_map, city_roads, city_blocks, passenger_blocks, routes = loadCityMap("city_map_21x21.txt")
 
     height = len(city_map)
     width = len(city_map[0])
@@ -97,19 +125,33 @@ def launch_city_model():
     pixel_ratio = 5
 
 
-    city_roads, city_blocks, passenger_blocks, routes = getRoads(city_map, height, width)
-
     n_slider = UserSettableParameter('slider', "Number of Cabs", 5, 1, 10, 1)
 
     passenger_population = UserSettableParameter('slider', "Passenger Population", .1, 0, 1, .05)
 
     passenger_pooling = UserSettableParameter('slider', "Passenger Pooling %", .5, 0, 1, .1)
 
+    cab_speed = UserSettableParameter('slider', "Cab Speed (cells per step)", 1, 1, 5, 1)
+
+    max_seats = UserSettableParameter('slider', "Max Seats", 3, 2, 12, 1)
+
+    assignment = UserSettableParameter('choice', "Assignment", value="greedy", choices=["greedy", "optimal"])
+
+    dispatch_interval = UserSettableParameter('slider', "Dispatch Interval (steps)", 1, 1, 10, 1)
+
+    dispatch_threshold = UserSettableParameter('slider', "Dispatch Threshold (new passengers, 0 = off)", 0, 0, 20, 1)
+
+    bid_mode = UserSettableParameter('choice', "Bid Mode", value="distance", choices=["distance", "insertion"])
+
+    max_detour = UserSettableParameter('slider', "Max Detour (over the direct distance)", .5, 0, 2, .1)
+
+    sighting_radius = UserSettableParameter('slider', "Sighting Radius (cells)", 1, 1, 5, 1)
+
     # grid = CanvasGrid(agent_draw, width, height,
                     #   width * pixel_ratio, height * pixel_ratio)
 
-    grid = CanvasGrid(agent_draw, width, height,
-                      500, 500)
+    grid = CityCanvasGrid(agent_draw, width, height,
+                          500, 500)
 
     chart_element = ChartModule([{"Label": "Normal Passenger", "Color": "#000000"},
                              {"Label": "Pooling Passenger", "Color": "#0033cc"},
@@ -126,7 +168,7 @@ def launch_city_model():
     over_travelled = ChartModule([{"Label": "Overtravelled (in percentage)", "Color": "#990000"}]) 
 
     server = ModularServer(CityModel, [grid, chart_element, chart_element_cars_carpooling, passengers_traveling, over_travelled], "SOAS Project - Rafael Bianchi",
-                           {"N": n_slider, "PassengerPopulation":passenger_population, "PassengerPooling": passenger_pooling, "PassengerBlocks": passenger_blocks, "width": width, "height": height, "city_map": city_map, "roads": city_roads, "city_blocks": city_blocks, "routes": routes})
+                           {"N": n_slider, "PassengerPopulation":passenger_population, "PassengerPooling": passenger_pooling, "CabSpeed": cab_speed, "MaxSeats": max_seats, "Assignment": assignment, "DispatchInterval": dispatch_interval, "DispatchThreshold": dispatch_threshold, "BidMode": bid_mode, "MaxDetour": max_detour, "SightingRadius": sighting_radius, "PassengerBlocks": passenger_blocks, "width": width, "height": height, "city_map": city_map, "roads": city_roads, "city_blocks": city_blocks, "routes": routes})
     server.max_steps = 0
     server.port = 8521
     server.launch()
@@ -0,0 +1,149 @@
+import heapq
+
+class GridIndex:
+    #Items bucketed by position in square buckets of `bucket_size` cells,
+    # to find the items nearest to a position without looking at all of
+    # them
+    def __init__(self, bucket_size=8):
+        self.bucket_size = bucket_size
+        self.buckets = {}
+        self.positions = {}
+
+        #Bounds of the buckets ever used, to know when a search is done
+        self.bounds = None
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, item):
+        return item in self.positions
+
+    def bucket(self, pos):
+        return (pos[0] // self.bucket_size, pos[1] // self.bucket_size)
+
+    def add(self, item, pos):
+        if(item in self.positions):
+            if(self.positions[item] == pos):
+                return
+            self.remove(item)
+
+        key = self.bucket(pos)
+        self.positions[item] = pos
+        self.buckets.setdefault(key, {})[item] = pos
+
+        if(self.bounds is None):
+            self.bounds = [key[0], key[0], key[1], key[1]]
+        else:
+            self.bounds = [min(self.bounds[0], key[0]), max(self.bounds[1], key[0]),
+                           min(self.bounds[2], key[1]), max(self.bounds[3], key[1])]
+
+    def remove(self, item):
+        pos = self.positions.pop(item, None)
+        if(pos is None):
+            return
+
+        key = self.bucket(pos)
+        bucket = self.buckets[key]
+        del bucket[item]
+
+        if(len(bucket) == 0):
+            del self.buckets[key]
+
+    def ring(self, center, radius):
+        #Bucket keys at Chebyshev distance `radius` from the center bucket
+        x, y = center
+        if(radius == 0):
+            return [center]
+
+        keys = []
+        for dx in range(-radius, radius + 1):
+            keys.append((x + dx, y - radius))
+            keys.append((x + dx, y + radius))
+        for dy in range(-radius + 1, radius):
+            keys.append((x - radius, y + dy))
+            keys.append((x + radius, y + dy))
+
+        return keys
+
+    def nearest(self, pos, k, distance=None, accept=None):
+        #The (up to) k accepted items closest to pos, closest first.
+        # distance(item_pos) defaults to the Manhattan distance and can be
+        # a route distance, as long as it is never shorter than the
+        # Manhattan distance (negative means unreachable). Buckets are
+        # visited in rings around pos until no unvisited bucket can hold
+        # an item closer than the k-th found so far
+        if(distance is None):
+            distance = lambda item_pos: abs(item_pos[0] - pos[0]) + abs(item_pos[1] - pos[1])
+
+        if(k <= 0 or self.bounds is None):
+            return []
+
+        center = self.bucket(pos)
+        max_radius = max(center[0] - self.bounds[0], self.bounds[1] - center[0],
+                         center[1] - self.bounds[2], self.bounds[3] - center[1])
+
+        #Max-heap of the best k as (-distance, -order, item)
+        best = []
+        order = 0
+
+        for radius in range(max_radius + 1):
+            if(len(best) == k and (radius - 1) * self.bucket_size + 1 >= -best[0][0]):
+                break
+
+            for key in self.ring(center, radius):
+                for item, item_pos in self.buckets.get(key, {}).items():
+                    if(accept is not None and not accept(item)):
+                        continue
+
+                    d = distance(item_pos)
+                    order += 1
+                    if(d < 0):
+                        continue
+
+                    if(len(best) < k):
+                        heapq.heappush(best, (-d, -order, item))
+                    elif(d < -best[0][0]):
+                        heapq.heapreplace(best, (-d, -order, item))
+
+        return [item for _, _, item in sorted(best, key=lambda entry: (-entry[0], -entry[1]))]
+
+class SightingTable:
+    #Passengers only wait at the fixed passenger slots, so the slots a
+    # cab sees from every road cell are listed once, and an occupancy
+    # bitmap with the passenger of every slot tells which are waiting.
+    # `neighborhood(cell)` gives the cells seen from a road cell
+    def __init__(self, slots, cells, neighborhood):
+        self.slots = list(slots)
+        self.slot_index = {pos: idx for idx, pos in enumerate(self.slots)}
+
+        self.occupied = bytearray(len(self.slots))
+        self.passengers = [None] * len(self.slots)
+
+        #Road cell -> slots seen from it, and slot -> road cells seeing it
+        self.seen_from = {}
+        self.seen_by = [[] for _ in self.slots]
+        for cell in cells:
+            seen = tuple(self.slot_index[pos] for pos in neighborhood(cell) if pos in self.slot_index)
+            if(len(seen) > 0):
+                self.seen_from[cell] = seen
+                for slot in seen:
+                    self.seen_by[slot].append(cell)
+
+    def add(self, passenger):
+        slot = self.slot_index[passenger.pos]
+        self.occupied[slot] = 1
+        self.passengers[slot] = passenger
+
+    def remove(self, passenger):
+        slot = self.slot_index[passenger.pos]
+        if(self.passengers[slot] is passenger):
+            self.occupied[slot] = 0
+            self.passengers[slot] = None
+
+    def around(self, pos):
+        #Passengers waiting in the slots seen from pos
+        return [self.passengers[slot] for slot in self.seen_from.get(pos, ()) if self.occupied[slot]]
+
+    def watchers(self, pos):
+        #Road cells from where the slot at pos is seen
+        return self.seen_by[self.slot_index[pos]]
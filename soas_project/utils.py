@@ -1,85 +1,384 @@
-def shortest_path(city_model, start, goal):
-    try:
-        return next(bfs_paths(city_model, start, goal))
-    except StopIteration:
-        return None
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import deque
+
+import numpy as np
+
+from .routing import GridRouteTable, LazyRouteTable, RouteTable, dijkstra_tree, getIncoming
+
+#Map cells: 0 is a road, 1 a block. A two digit value <cost><way> is a
+# road too, where cost (1-25) is the cost of driving into the cell and
+# way is 0 for a two-way road or 1-4 for a one-way road that can only
+# be driven right, up, down or left as seen in the map file.
+ROAD = 0
+BLOCK = 1
+
+#Values of the static block layer of a model, indexed by position
+BLOCK_CENTER = 2
+
+#Neighbor offsets, in the order the map has always been scanned. Seen
+# in the map file they point right, up, down and left.
+DIRECTIONS = [(0, -1), (-1, 0), (1, 0), (0, 1)]
+
+def bfs_tree(incoming_roads, goal):
+    #Single BFS rooted at the goal, following the roads backwards: for
+    # every road cell that can reach the goal it gives the neighbor one
+    # step closer to it and the number of steps left
+    next_pos = {goal: goal}
+    distance = {goal: 0}
+    queue = deque([goal])
 
-def bfs_paths(city_model, start, goal):
-    queue = [(start, [start])]
     while queue:
-        (vertex, path) = queue.pop(0)
-        for next in city_model[vertex] - set(path):
-            if next == goal:
-                yield path + [next]
-            else:
-                queue.append((next, path + [next]))
+        vertex = queue.popleft()
+        for neighbor in incoming_roads[vertex]:
+            if neighbor not in distance:
+                next_pos[neighbor] = vertex
+                distance[neighbor] = distance[vertex] + 1
+                queue.append(neighbor)
+
+    return next_pos, distance
+
+def getIncomingRoads(city_roads):
+    #Roads leading into every road cell (they differ from the
+    # neighbors only around one-way roads)
+    incoming = {pos: set() for pos in city_roads.keys()}
+    for pos, neighbors in city_roads.items():
+        for neighbor in neighbors:
+            incoming[neighbor].add(pos)
+
+    return incoming
+
+def isConnected(city_roads, closed=()):
+    #True when every open road can reach every other open road without
+    # driving into a closed one
+    open_roads = [pos for pos in city_roads.keys() if pos not in closed]
+    if(len(open_roads) == 0):
+        return True
+
+    for roads in (city_roads, getIncomingRoads(city_roads)):
+        seen = {open_roads[0]}
+        queue = deque(seen)
+        while queue:
+            vertex = queue.popleft()
+            for neighbor in roads[vertex]:
+                if neighbor not in seen and neighbor not in closed:
+                    seen.add(neighbor)
+                    queue.append(neighbor)
+
+        if(len(seen) < len(open_roads)):
+            return False
+
+    return True
+
+def shortest_path(city_roads, start, goal):
+    next_pos, _ = bfs_tree(getIncomingRoads(city_roads), goal)
+
+    if start not in next_pos:
+        return None
+
+    path = [start]
+    while path[-1] != goal:
+        path.append(next_pos[path[-1]])
+
+    return path
 
 def getShortestPaths(city_roads):
     directions = {}
-    roads_pos = list(city_roads.keys()) 
+    incoming_roads = getIncomingRoads(city_roads)
 
-    for i in range(0, len(roads_pos)):
-        pos_from = roads_pos[i]
-        for j in range(i+1, len(roads_pos)):
-            pos_to = roads_pos[j]
+    #One BFS per destination fills the whole column
+    # routes[*][pos_to] at once
+    for pos_to in city_roads.keys():
+        next_pos, distance = bfs_tree(incoming_roads, pos_to)
 
-            path = shortest_path(city_roads, pos_from, pos_to)
+        for pos_from in next_pos.keys():
+            if(pos_from == pos_to):
+                continue
 
-            if(len(path) > 0):
-                if(pos_from not in directions):
-                    directions[pos_from] = {}
-                
-                if(pos_to not in directions):
-                    directions[pos_to] = {}
+            if(pos_from not in directions):
+                directions[pos_from] = {}
 
-                directions[pos_from][pos_to] = {"next_pos": path[1], "distance": len(path) - 1}
-                directions[pos_to][pos_from] = {"next_pos": path[-2], "distance": len(path) - 1}
+            directions[pos_from][pos_to] = {"next_pos": next_pos[pos_from], "distance": distance[pos_from]}
 
     return directions
 
-def getRoads(city_map, height, width):
-    city_roads = {}
-    city_blocks = []
-    passenger_blocks = {}
-
-    for idx_line, line in enumerate(city_map):
-        for idx_col, cell in enumerate(line):
-            pos = (idx_line, (height - 1) - idx_col)
-            if (cell == '0'):
-                neighbors = set()
-                for next_pos in [(0,-1), (-1, 0), (1,0), (0,1)]:
-                    node_position = (pos[0] + next_pos[0], pos[1] + next_pos[1])
-                    
-                    if node_position[0] > width - 1 or node_position[0] < 0 or \
-                       node_position[1] > height - 1 or node_position[1] < 0:
-                        continue
-
-                    if city_map[node_position[0]][node_position[1]] != '0':
-                        continue
-
-                    neighbors.add(node_position)
-                
-                city_roads[pos] = neighbors
-            else:
-                blocks_around = []
-                for next_pos in [(0,-1), (-1, 0), (1,0), (0,1)]:
-                    node_position = (pos[0] + next_pos[0], pos[1] + next_pos[1])
-                    
-                    if node_position[0] > width - 1 or node_position[0] < 0 or \
-                        node_position[1] > height - 1 or node_position[1] < 0:
-                        continue
-
-                    if city_map[node_position[0]][node_position[1]] != '0':
-                        continue
-
-                    blocks_around.append(node_position)
-                
-                isCenterBlock = len(blocks_around) == 0 
-                city_blocks.append((pos, isCenterBlock))
-                
-                if(len(blocks_around) == 1):
-                    passenger_blocks[pos]= blocks_around[0]
-                
-    routes = getShortestPaths(city_roads)
-
-    return city_roads, city_blocks, passenger_blocks, routes
\ No newline at end of file
+def getRouteTable(city_roads, costs=None):
+    #costs maps road cells to the cost of driving into them (1 when
+    # missing). Without costs every move costs 1 and all the trees are
+    # built at once by a BFS frontier expansion, otherwise by Dijkstra.
+    cells = list(city_roads.keys())
+    index = {pos: idx for idx, pos in enumerate(cells)}
+    n = len(cells)
+
+    neighbors = np.full((n, 4), -1, dtype=np.int32)
+    for idx, pos in enumerate(cells):
+        for slot, neighbor in enumerate(sorted(city_roads[pos])):
+            neighbors[idx, slot] = index[neighbor]
+
+    cost_list = [costs.get(pos, 1) for pos in cells] if costs else [1] * n
+    dtype = np.int16 if sum(cost_list) < np.iinfo(np.int16).max else np.int32
+
+    if(any(cost != 1 for cost in cost_list)):
+        distance = np.full((n, n), -1, dtype=dtype)
+        next_hop = np.full((n, n), -1, dtype=dtype)
+        incoming = getIncoming(neighbors)
+
+        for idx_to in range(n):
+            distance[:, idx_to], next_hop[:, idx_to] = dijkstra_tree(incoming, cost_list, idx_to)
+
+        return RouteTable(cells, distance, next_hop, neighbors, np.array(cost_list, dtype=np.int32))
+
+    distance = np.full((n, n), -1, dtype=dtype)
+    next_hop = np.full((n, n), -1, dtype=dtype)
+    np.fill_diagonal(distance, 0)
+    np.fill_diagonal(next_hop, np.arange(n))
+
+    #Frontier expansion for all destinations at once: frontier[i, j]
+    # is True when cell i was reached from destination j in the
+    # previous step, so its unreached neighbors get next_hop = i
+    frontier = np.eye(n, dtype=bool)
+    step = 0
+    while frontier.any():
+        step += 1
+        reached = np.zeros((n, n), dtype=bool)
+
+        for slot in range(neighbors.shape[1]):
+            rows = np.nonzero(neighbors[:, slot] >= 0)[0]
+            cols = neighbors[rows, slot].astype(np.int64)
+
+            hits = frontier[cols] & (distance[rows] < 0) & ~reached[rows]
+            idx_row, idx_to = np.nonzero(hits)
+
+            next_hop[rows[idx_row], idx_to] = cols[idx_row]
+            reached[rows[idx_row], idx_to] = True
+
+        distance[reached] = step
+        frontier = reached
+
+    return RouteTable(cells, distance, next_hop, neighbors)
+
+def getGridLines(road, height):
+    #Road lines (x values, y values) when the road mask is a regular
+    # Manhattan grid: every road cell lies on a full line of roads, the
+    # first and last lines of each axis are roads and there is a block
+    # between any two lines (no two-cell wide avenues). None otherwise.
+    full_lines = road.all(axis=1)
+    full_columns = road.all(axis=0)
+
+    if(not (full_lines[0] and full_lines[-1] and full_columns[0] and full_columns[-1])):
+        return None
+
+    if((road != (full_lines[:, None] | full_columns[None, :])).any()):
+        return None
+
+    if((np.diff(np.nonzero(full_lines)[0]) == 1).any() or (np.diff(np.nonzero(full_columns)[0]) == 1).any()):
+        return None
+
+    lines_x = np.nonzero(full_lines)[0].tolist()
+    lines_y = sorted(((height - 1) - np.nonzero(full_columns)[0]).tolist())
+
+    return lines_x, lines_y
+
+def makeGridMap(blocks, block_size=4):
+    #Regular Manhattan city with blocks x blocks squares of
+    # block_size x block_size cells separated by one-cell roads
+    size = blocks * (block_size + 1) + 1
+    on_road = np.arange(size) % (block_size + 1) == 0
+
+    return np.where(on_road[:, None] | on_road[None, :], ROAD, BLOCK).astype(np.uint8)
+
+def getRoadMask(city_map):
+    city_map = np.asarray(city_map)
+
+    if(city_map.dtype.kind == "U"):
+        return city_map == str(ROAD)
+
+    return (city_map == ROAD) | (city_map >= 10)
+
+def getRoadLayers(city_map):
+    #Cost of driving into every cell and one-way direction (index in
+    # DIRECTIONS plus one, 0 for two-way roads)
+    city_map = np.asarray(city_map)
+
+    if(city_map.dtype.kind == "U"):
+        return np.ones(city_map.shape, dtype=np.int32), np.zeros(city_map.shape, dtype=np.int8)
+
+    weighted = city_map >= 10
+    costs = np.where(weighted, city_map // 10, 1).astype(np.int32)
+    ways = np.where(weighted, city_map % 10, 0).astype(np.int8)
+
+    return costs, ways
+
+def getNeighborLayers(layer, fill=0):
+    #layer of the neighbor in each of the DIRECTIONS, per map cell
+    padded = np.pad(layer, 1, constant_values=fill)
+
+    return np.stack([padded[1:-1, 2:], padded[:-2, 1:-1], padded[2:, 1:-1], padded[1:-1, :-2]])
+
+def getRoads(city_map, height, width, routing="table"):
+    #Map cell (line, column) is placed at position (line, height - 1 - column)
+    road = getRoadMask(city_map)
+    costs, ways = getRoadLayers(city_map)
+
+    #around[d, line, column]: the neighbor in DIRECTIONS[d] is a road
+    around = getNeighborLayers(road, False)
+
+    #A move can't go against the way of a one-way road, neither the
+    # one it leaves nor the one it enters
+    against = (len(DIRECTIONS) - np.arange(len(DIRECTIONS)))[:, None, None]
+    drivable = around & (ways[None] != against) & (getNeighborLayers(ways) != against)
+    bits = (1 << np.arange(len(DIRECTIONS)))[:, None]
+
+    #Roads: the neighbor sets are built for all the cells sharing the
+    # same combination of drivable neighbors at once
+    idx_lines, idx_cols = np.nonzero(road)
+    xs = idx_lines
+    ys = (height - 1) - idx_cols
+    pattern = (drivable[:, idx_lines, idx_cols] * bits).sum(axis=0)
+
+    neighbors = np.empty(len(xs), dtype=object)
+    for p in np.unique(pattern).tolist():
+        selected = np.nonzero(pattern == p)[0]
+        columns = [zip((xs[selected] + dx).tolist(), (ys[selected] + dy).tolist())
+                   for d, (dx, dy) in enumerate(DIRECTIONS) if p >> d & 1]
+
+        sets = np.empty(len(selected), dtype=object)
+        sets[:] = list(map(set, zip(*columns))) if columns else [set() for _ in selected]
+        neighbors[selected] = sets
+
+    city_roads = dict(zip(zip(xs.tolist(), ys.tolist()), neighbors.tolist()))
+
+    road_costs = None
+    if((costs[road] != 1).any()):
+        road_costs = dict(zip(city_roads.keys(), costs[idx_lines, idx_cols].tolist()))
+
+    #Blocks: center blocks touch no road, and blocks touching exactly
+    # one road are where passengers wait
+    idx_lines, idx_cols = np.nonzero(~road)
+    xs = idx_lines
+    ys = (height - 1) - idx_cols
+    flags = around[:, idx_lines, idx_cols]
+    count = flags.sum(axis=0)
+
+    city_blocks = list(zip(zip(xs.tolist(), ys.tolist()), (count == 0).tolist()))
+
+    single = np.nonzero(count == 1)[0]
+    offsets = np.array(DIRECTIONS)[np.argmax(flags[:, single], axis=0)]
+    passenger_blocks = dict(zip(zip(xs[single].tolist(), ys[single].tolist()),
+                                zip((xs[single] + offsets[:, 0]).tolist(), (ys[single] + offsets[:, 1]).tolist())))
+
+    #The analytic grid routes only know plain two-way roads
+    grid_lines = None
+    if(routing == "grid" and road_costs is None and not ways.any()):
+        grid_lines = getGridLines(road, height)
+
+    if(grid_lines is not None):
+        routes = GridRouteTable(city_roads, *grid_lines)
+    elif(routing == "lazy"):
+        routes = LazyRouteTable(city_roads, road_costs)
+    else:
+        routes = getRouteTable(city_roads, road_costs)
+
+    #Roads apart or one-way roads can leave cabs with nowhere to go. The
+    # dense table already holds the distances to check it, the lazy
+    # routes walk the roads and the grid routes are connected by
+    # construction
+    if(isinstance(routes, RouteTable)):
+        connected = routes.is_connected()
+    else:
+        connected = grid_lines is not None or isConnected(city_roads)
+
+    if(not connected):
+        raise ValueError('Some roads of the map cannot be reached from the others')
+
+    return city_roads, city_blocks, passenger_blocks, routes
+
+ROUTE_CACHE_DIR = ".route_cache"
+ROUTE_CACHE_VERSION = 3
+
+def readCityMap(filename):
+    #Map as a 2D uint8 array (ROAD or BLOCK per cell), either from the
+    # tab separated text format or from the binary .npy format
+    if(filename.endswith(".npy")):
+        return np.load(filename)
+
+    return np.loadtxt(filename, delimiter='\t', dtype=np.uint8, ndmin=2)
+
+def writeCityMap(filename, city_map):
+    #Binary map format: the uint8 cell array saved with np.save
+    np.save(filename, np.asarray(city_map, dtype=np.uint8))
+
+def getBlockLayer(city_blocks, width, height):
+    #Static layer of the blocks indexed by position: BLOCK for the blocks
+    # touching a road, BLOCK_CENTER for the others and ROAD elsewhere
+    layer = np.full((width, height), ROAD, dtype=np.uint8)
+
+    if(len(city_blocks) > 0):
+        positions, centers = zip(*city_blocks)
+        xs, ys = np.array(positions).T
+        layer[xs, ys] = np.where(centers, BLOCK_CENTER, BLOCK)
+
+    return layer
+
+def saveCity(directory, city_roads, city_blocks, passenger_blocks, routes):
+    #city_roads is stored by the routes, as their neighbors array
+    blocks = np.array([(pos[0], pos[1], isCenterBlock) for pos, isCenterBlock in city_blocks], dtype=np.int32).reshape(-1, 3)
+    accesses = np.array([pos + road for pos, road in passenger_blocks.items()], dtype=np.int32).reshape(-1, 4)
+
+    np.save(os.path.join(directory, "blocks.npy"), blocks)
+    np.save(os.path.join(directory, "passenger_blocks.npy"), accesses)
+    routes.save(directory)
+
+def loadCity(directory, mmap_mode="r"):
+    routes = RouteTable.load(directory, mmap_mode)
+    cells = routes.cells
+
+    neighbors = np.load(os.path.join(directory, "neighbors.npy")).tolist()
+    city_roads = {pos: set(cells[idx] for idx in neighbors[i] if idx >= 0) for i, pos in enumerate(cells)}
+
+    blocks = np.load(os.path.join(directory, "blocks.npy")).tolist()
+    city_blocks = [((x, y), bool(isCenterBlock)) for x, y, isCenterBlock in blocks]
+
+    accesses = np.load(os.path.join(directory, "passenger_blocks.npy")).tolist()
+    passenger_blocks = {(x, y): (road_x, road_y) for x, y, road_x, road_y in accesses}
+
+    return city_roads, city_blocks, passenger_blocks, routes
+
+def getCityCache(filename, cache_dir=ROUTE_CACHE_DIR):
+    #Directory holding the roads, blocks and routes computed from the
+    # map file, keyed by the hash of its contents. It is only built
+    # when no entry exists for the current contents of the map.
+    with open(filename, "rb") as f:
+        content = f.read()
+
+    digest = hashlib.sha256(content + b"v%d" % ROUTE_CACHE_VERSION).hexdigest()
+    directory = os.path.join(cache_dir, digest)
+
+    if(not os.path.isdir(directory)):
+        city_map = readCityMap(filename)
+        city_roads, city_blocks, passenger_blocks, routes = getRoads(city_map, len(city_map), len(city_map[0]))
+
+        #Write to a temporary directory first so that concurrent runs
+        # never see a half written cache entry
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_directory = tempfile.mkdtemp(dir=cache_dir)
+        saveCity(tmp_directory, city_roads, city_blocks, passenger_blocks, routes)
+        try:
+            os.rename(tmp_directory, directory)
+        except OSError:
+            shutil.rmtree(tmp_directory)
+
+    return directory
+
+def loadCityMap(filename, cache_dir=ROUTE_CACHE_DIR, routing="table"):
+    #Parsed map plus roads, blocks, passenger blocks and routes, using
+    # the on disk cache unless cache_dir is None. Lazy and grid routes
+    # are never cached, they are meant for maps too big for a full table.
+    city_map = readCityMap(filename)
+
+    if(cache_dir is None or routing != "table"):
+        return (city_map,) + getRoads(city_map, len(city_map), len(city_map[0]), routing)
+
+    return (city_map,) + loadCity(getCityCache(filename, cache_dir))
@@ -0,0 +1,110 @@
+import random
+
+import pytest
+
+from soas_project.agents import Passenger
+from soas_project.dispatch import greedy_assignment, greedy_rescan_assignment, optimal_assignment
+from soas_project.model import CityModel
+from soas_project.utils import getRoads, makeGridMap
+
+def random_biddings(r, max_cabs=8, max_passengers=8, max_distance=10):
+    #Small distances, so that there are plenty of ties
+    cabs = [f'cab{idx}' for idx in range(r.randint(0, max_cabs))]
+    passengers = [f'psg{idx}' for idx in range(r.randint(1, max_passengers))]
+
+    return {cab: {psg: r.randint(0, max_distance) for psg in r.sample(passengers, r.randint(0, len(passengers)))}
+            for cab in cabs}
+
+def test_greedy_assignment_matches_rescan():
+    r = random.Random(0)
+
+    for _ in range(3000):
+        biddings = random_biddings(r)
+
+        assert list(greedy_assignment(biddings).items()) == list(greedy_rescan_assignment(biddings).items())
+
+def test_optimal_assignment_matches_negative_bids():
+    winners = optimal_assignment({"A": {"p1": -5}, "B": {"p2": -3, "p1": -4}})
+
+    assert winners == {"p1": "A", "p2": "B"}
+
+def test_optimal_assignment_ignores_shifted_bids():
+    #Adding the same value to every bid does not change the matching
+    r = random.Random(0)
+
+    for _ in range(200):
+        biddings = random_biddings(r, 6, 6, 20)
+        shift = r.randint(-30, -1)
+        shifted = {cab: {psg: bid + shift for psg, bid in offers.items()} for cab, offers in biddings.items()}
+
+        winners = optimal_assignment(biddings)
+        assert len(optimal_assignment(shifted)) == len(winners)
+        assert sum(biddings[cab][psg] for psg, cab in optimal_assignment(shifted).items()) == \
+               sum(biddings[cab][psg] for psg, cab in winners.items())
+
+def make_model(**params):
+    city_map = makeGridMap(5, 6)
+    size = len(city_map)
+    city_roads, city_blocks, passenger_blocks, routes = getRoads(city_map, size, size)
+
+    return CityModel(PassengerBlocks=passenger_blocks, width=size, height=size, city_map=city_map,
+                     roads=city_roads, city_blocks=city_blocks, routes=routes, seed=0, **params)
+
+def assert_consistent(dispatcher):
+    #Every cab goes to at most one passenger, the one assigned to it, and
+    # the passengers without a cab are exactly the indexed ones
+    assert dispatcher.assigned == {cab: psg for psg, cab in dispatcher.assignments.items() if cab is not None}
+    assert list(dispatcher.waiting) == [psg for psg, cab in dispatcher.assignments.items() if cab is None]
+    assert all(dispatcher.unassigned.positions[psg] == psg.road_access for psg in dispatcher.waiting)
+
+def test_dispatcher_follows_a_passenger_to_its_pickup():
+    model = make_model(N=2, PassengerPopulation=0)
+    dispatcher = model.dispatcher
+    cab1, cab2 = model.cabs
+    pos, access = sorted(model.passenger_blocks.items())[0]
+    passenger = Passenger(100, model, pos, cab1.pos, access, False)
+
+    dispatcher.sight(passenger)
+    dispatcher.sight(passenger)
+    assert passenger in dispatcher and dispatcher.sighted == 1
+    assert list(dispatcher.waiting) == [passenger]
+    assert_consistent(dispatcher)
+
+    dispatcher.assign(passenger, cab1)
+    assert cab1.passenger_assigned is passenger and passenger.has_cab_assigned
+    assert len(dispatcher.waiting) == 0
+    assert_consistent(dispatcher)
+
+    #Given to another cab, the first one is free again
+    dispatcher.assign(passenger, cab2)
+    assert not cab1.has_passenger_assigned and cab2.passenger_assigned is passenger
+    assert_consistent(dispatcher)
+
+    dispatcher.pickup(passenger)
+    assert passenger not in dispatcher and len(dispatcher) == 0
+    assert not cab2.has_passenger_assigned
+    assert_consistent(dispatcher)
+
+    #A passenger picked up before getting a cab leaves the index as well
+    other = Passenger(101, model, pos, cab1.pos, access, True)
+    dispatcher.sight(other)
+    dispatcher.pickup(other)
+    assert len(dispatcher) == 0 and len(dispatcher.waiting) == 0
+
+@pytest.mark.parametrize("params", [{}, {"BidCandidates": 2}, {"BidMode": "insertion", "PassengerPooling": .8},
+                                    {"Assignment": "optimal", "DispatchInterval": 3}])
+def test_dispatcher_stays_consistent_during_a_run(params):
+    model = make_model(N=6, PassengerPopulation=.3, **params)
+    picked_up = 0
+
+    for _ in range(200):
+        model.step()
+        assert_consistent(model.dispatcher)
+
+        #Riders and removed passengers are never waiting or assigned
+        riders = [psg for cab in model.cabs for psg in cab.passengers]
+        assert not any(psg in model.dispatcher for psg in riders)
+        assert all(psg in model.passengers for psg in model.dispatcher.assignments)
+        picked_up += len(riders)
+
+    assert picked_up > 0
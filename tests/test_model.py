@@ -0,0 +1,160 @@
+import os
+import random
+
+import pytest
+
+from soas_project.agents import Passenger
+from soas_project.model import CityModel
+from soas_project.routing import CLOSED
+from soas_project.utils import getRoads, makeGridMap, readCityMap
+
+def make_models(routing, count=2, **params):
+    #Models built on the same routes, as the server and the sweeps do
+    city_map = makeGridMap(5, 6)
+    size = len(city_map)
+    city_roads, city_blocks, passenger_blocks, routes = getRoads(city_map, size, size, routing)
+
+    return [CityModel(PassengerBlocks=passenger_blocks, width=size, height=size, city_map=city_map,
+                      roads=city_roads, city_blocks=city_blocks, routes=routes, seed=0, **params)
+            for _ in range(count)]
+
+@pytest.mark.parametrize("routing", ["table", "lazy"])
+def test_closing_a_road_leaves_other_models_alone(routing):
+    closed, other = make_models(routing)
+    pos = (7, 7)
+
+    closed.close_road(pos)
+    for _ in range(10):
+        closed.step()
+
+    assert other.routes.cost(pos) == 1
+    assert pos in other.open_roads
+    assert other.routes.distance((0, 7), (14, 7)) == 14
+
+    closed.reopen_road(pos)
+    assert closed.routes.cost(pos) == 1
+
+def test_closing_a_road_needs_changeable_routes():
+    model, = make_models("grid", count=1)
+
+    with pytest.raises(ValueError):
+        model.close_road((7, 7))
+
+    assert model.closed_roads == {}
+    assert (7, 7) in model.open_roads
+
+@pytest.mark.parametrize("bid_mode", ["distance", "insertion"])
+def test_riders_are_dropped_at_their_destination(bid_mode):
+    model, = make_models("table", count=1, N=20, PassengerPopulation=.3, BidMode=bid_mode)
+
+    drops = 0
+    for _ in range(200):
+        riders = {cab: (cab.pos, list(cab.passengers)) for cab in model.cabs}
+        model.step()
+
+        for cab, (pos, passengers) in riders.items():
+            for passenger in passengers:
+                if(passenger not in cab.passengers):
+                    assert pos == passenger.destination
+                    drops += 1
+
+    assert drops > 0
+
+def test_unreachable_passengers_get_no_bids():
+    model, = make_models("table", count=1, N=1, PassengerPopulation=0)
+    cab = model.cabs[0]
+    (pos1, access1), (pos2, access2) = [(pos, access) for pos, access in model.passenger_blocks.items()
+                                        if access != cab.pos][:2]
+
+    for idx, (pos, access) in enumerate([(pos1, access1), (pos2, access2)]):
+        model.dispatcher.sight(Passenger(100 + idx, model, pos, cab.pos, access, False))
+
+    #Nothing drives into the first road access anymore
+    model.own_routes()
+    model.routes.set_cost(access1, CLOSED)
+
+    model.clear_biddings()
+    cab.stage_3()
+
+    assert list(model.all_biddings[cab].keys()) == [p for p in model.dispatcher.waiting if p.road_access == access2]
+
+@pytest.mark.parametrize("params", [{"BidCandidates": 3}, {"BidCandidates": 3, "Engine": "vector"}, {}])
+def test_nearest_free_cabs_match_a_scan(params):
+    model, = make_models("table", count=1, N=30, PassengerPopulation=.3, **params)
+    r = random.Random(0)
+    roads = list(model.roads.keys())
+
+    for _ in range(20):
+        model.step()
+
+        free = [cab for cab in model.cabs if cab.has_free_seats and not cab.has_passenger_assigned]
+        for pos in r.sample(roads, 5):
+            found = model.nearest_free_cabs(pos, 4)
+
+            assert all(cab in free for cab in found)
+            assert [model.routes.distance(cab.pos, pos) for cab in found] == \
+                   sorted(model.routes.distance(cab.pos, pos) for cab in free)[:4]
+
+def test_bid_candidates_reach_every_waiting_passenger():
+    model, = make_models("table", count=1, N=5, PassengerPopulation=0, BidCandidates=1)
+    r = random.Random(0)
+
+    for idx, (pos, access) in enumerate(r.sample(sorted(model.passenger_blocks.items()), 20)):
+        model.dispatcher.sight(Passenger(100 + idx, model, pos, r.choice(list(model.roads.keys())), access, False))
+
+    model.clear_biddings()
+    for cab in model.cabs:
+        cab.stage_3()
+
+    #Every waiting passenger gets a bid from its nearest free cab
+    for passenger in model.dispatcher.waiting:
+        cab, = model.nearest_free_cabs(passenger.road_access, 1, passenger)
+        assert passenger in model.all_biddings[cab]
+
+def make_map_model(filename, **params):
+    city_map = readCityMap(os.path.join(os.path.dirname(__file__), os.pardir, filename))
+    height, width = len(city_map), len(city_map[0])
+    city_roads, city_blocks, passenger_blocks, routes = getRoads(city_map, height, width)
+
+    model = CityModel(PassengerBlocks=passenger_blocks, width=width, height=height, city_map=city_map,
+                      roads=city_roads, city_blocks=city_blocks, routes=routes, seed=0, **params)
+    #Without shuffling both engines draw the same random numbers
+    model.schedule.shuffle = False
+
+    return model
+
+@pytest.mark.parametrize("filename, cabs, population, params", [
+    ("city_map.txt", 2, .2, {}),
+    ("city_map_21x21.txt", 6, .3, {}),
+    ("city_map_21x21.txt", 6, .3, {"BidMode": "insertion", "PassengerPooling": .8}),
+    ("city_map_21x21.txt", 4, .2, {"CabSpeed": 3}),
+])
+def test_event_engine_matches_tick_engine(filename, cabs, population, params):
+    tick = make_map_model(filename, N=cabs, PassengerPopulation=population, **params)
+    event = make_map_model(filename, N=cabs, PassengerPopulation=population, Engine="event", **params)
+
+    for _ in range(300):
+        tick.step()
+    while(event.time < tick.time):
+        event.step()
+
+    ticks = tick.datacollector.get_model_vars_dataframe().drop(columns=["Dispatch CPU time (ms)"]).set_index("Time")
+    events = event.datacollector.get_model_vars_dataframe().drop(columns=["Dispatch CPU time (ms)"]).set_index("Time")
+    events = events[events.index <= tick.time]
+
+    assert len(events) < len(ticks)
+    assert (events == ticks.loc[events.index]).all().all()
+
+@pytest.mark.parametrize("params", [{}, {"PassengerPooling": .8, "CabSpeed": 2}, {"BidCandidates": 2}])
+def test_vector_engine_matches_tick_engine(params):
+    tick = make_map_model("city_map_21x21.txt", N=6, PassengerPopulation=.3, **params)
+    vector = make_map_model("city_map_21x21.txt", N=6, PassengerPopulation=.3, Engine="vector", **params)
+
+    for _ in range(200):
+        tick.step()
+        vector.step()
+
+    ticks = tick.datacollector.get_model_vars_dataframe().drop(columns=["Dispatch CPU time (ms)"])
+    vectors = vector.datacollector.get_model_vars_dataframe().drop(columns=["Dispatch CPU time (ms)"])
+
+    assert (vectors == ticks).all().all()
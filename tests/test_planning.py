@@ -0,0 +1,113 @@
+import random
+
+import numpy as np
+import pytest
+
+from soas_project.model import CityModel
+from soas_project.planning import (EXACT_STOPS, held_karp_order, insertion_cost, insertion_order, leg_matrix,
+                                   order_stops, permutation_order, plan_arrivals)
+from soas_project.utils import ROAD, getRoads, makeGridMap
+
+def weighted_city(seed=1):
+    #Regular map with road costs from 1 to 4
+    r = random.Random(seed)
+    city_map = makeGridMap(5, 6).astype(np.int32)
+    road = city_map == ROAD
+    costs = np.array([r.randint(1, 4) for _ in range(road.size)]).reshape(road.shape)
+    city_map[road] = (costs * 10)[road]
+
+    return city_map.astype(np.uint8)
+
+@pytest.mark.parametrize("params", [{}, {"CabSpeed": 2}, {"Engine": "vector", "CabSpeed": 3}])
+def test_plan_etas_count_cells(params):
+    city_map = weighted_city()
+    size = len(city_map)
+    city_roads, city_blocks, passenger_blocks, routes = getRoads(city_map, size, size)
+    model = CityModel(PassengerBlocks=passenger_blocks, width=size, height=size, city_map=city_map,
+                      roads=city_roads, city_blocks=city_blocks, routes=routes, N=10, PassengerPopulation=.3,
+                      seed=0, **params)
+
+    drops = 0
+    for _ in range(200):
+        planned = {cab: (cab.pos, list(zip(cab.passengers, cab.plan.etas))) for cab in model.cabs}
+        model.step()
+
+        #Riders are dropped in the tick after the cab reaches their stop
+        for cab, (pos, etas) in planned.items():
+            for passenger, eta in etas:
+                if(passenger not in cab.passengers):
+                    assert pos == passenger.destination
+                    assert eta == model.time - 1
+                    drops += 1
+
+    assert drops > 0
+
+def random_stops(r, count):
+    #Stops on a small grid, so that some orders tie
+    return [(r.randint(0, 5), r.randint(0, 5)) for _ in range(count)]
+
+def manhattan(a, b):
+    return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+def test_held_karp_matches_every_permutation():
+    r = random.Random(0)
+
+    for _ in range(200):
+        legs = leg_matrix((r.randint(0, 5), r.randint(0, 5)), random_stops(r, r.randint(1, 6)), manhattan)
+
+        assert held_karp_order(legs) == permutation_order(legs)
+
+def test_order_stops_switches_to_insertion_above_exact_stops():
+    r = random.Random(0)
+    differ = 0
+
+    for _ in range(20):
+        start = (r.randint(0, 5), r.randint(0, 5))
+        stops = random_stops(r, EXACT_STOPS + 1)
+        legs = leg_matrix(start, stops, manhattan)
+
+        assert order_stops(start, stops, manhattan) == insertion_order(legs)
+        assert order_stops(start, stops[:-1], manhattan) == held_karp_order(leg_matrix(start, stops[:-1], manhattan))
+        differ += insertion_order(legs) != held_karp_order(legs)
+
+    #Otherwise the test could not tell the orderings apart
+    assert differ > 0
+
+def brute_insertion_cost(start, stops, pickup, dropoff, distance, slack, max_ride):
+    #Rebuilds the whole route for every drop-off position
+    before = plan_arrivals(start, stops, distance)
+    length = before[-1] if stops else 0
+
+    best = None
+    for at in range(len(stops) + 1):
+        arrivals = plan_arrivals(start, [pickup] + stops[:at] + [dropoff] + stops[at:], distance)
+        after = arrivals[1:at + 1] + arrivals[at + 2:]
+
+        if(slack is not None and any(new - old > late for new, old, late in zip(after, before, slack))):
+            continue
+        if(max_ride is not None and arrivals[at + 1] - arrivals[0] > max_ride):
+            continue
+
+        if(best is None or arrivals[-1] - length < best[0]):
+            best = (arrivals[-1] - length, at)
+
+    return best
+
+def test_insertion_cost_matches_trying_every_position():
+    r = random.Random(0)
+    found = rejected = 0
+
+    for _ in range(500):
+        start, pickup, dropoff = random_stops(r, 3)
+        stops = random_stops(r, r.randint(0, 5))
+        slack = r.choice([None, [r.randint(0, 8) for _ in stops]])
+        max_ride = r.choice([None, r.randint(0, 10)])
+
+        best = insertion_cost(start, stops, pickup, dropoff, manhattan, slack, max_ride)
+        assert best == brute_insertion_cost(start, stops, pickup, dropoff, manhattan, slack, max_ride)
+
+        found += best is not None
+        rejected += best is None
+
+    #Both the cutoffs and the best position are exercised
+    assert found > 0 and rejected > 0
@@ -0,0 +1,240 @@
+import os
+import random
+
+import numpy as np
+import pytest
+
+from soas_project.routing import CLOSED, GridRouteTable, LazyRouteTable, Routes, RouteTable
+from soas_project import utils
+from soas_project.utils import (BLOCK, ROAD, getCityCache, getRoads, getRouteTable, loadCity, makeGridMap,
+                                writeCityMap)
+
+def grid_map(size, lines_x, lines_y):
+    #Square map whose roads are the full rows lines_x and columns lines_y
+    # (as stored in the map file)
+    on_line_x = np.isin(np.arange(size), lines_x)
+    on_line_y = np.isin(np.arange(size), lines_y)
+
+    return np.where(on_line_x[:, None] | on_line_y[None, :], ROAD, BLOCK).astype(np.uint8)
+
+def assert_same_routes(routes, table, city_roads):
+    for pos1 in table.keys():
+        for pos2 in table.keys():
+            assert routes.distance(pos1, pos2) == table.distance(pos1, pos2), (pos1, pos2)
+
+            if(pos1 != pos2):
+                next_pos = routes.next_pos(pos1, pos2)
+                assert next_pos in city_roads[pos1]
+                assert table.distance(next_pos, pos2) == table.distance(pos1, pos2) - 1
+
+def test_grid_routes_reject_adjacent_lines():
+    city_map = grid_map(9, [0, 7, 8], [0, 4, 5, 8])
+    city_roads, _, _, routes = getRoads(city_map, 9, 9, "grid")
+
+    assert isinstance(routes, RouteTable)
+    assert routes.distance((7, 7), (8, 7)) == 1
+
+def test_grid_routes_match_table_on_random_grids():
+    r = random.Random(0)
+
+    for _ in range(40):
+        size = r.randint(5, 14)
+        inner = list(range(1, size - 1))
+        lines_x = [0, size - 1] + r.sample(inner, r.randint(0, len(inner) // 2))
+        lines_y = [0, size - 1] + r.sample(inner, r.randint(0, len(inner) // 2))
+
+        city_map = grid_map(size, lines_x, lines_y)
+        city_roads, _, _, routes = getRoads(city_map, size, size, "grid")
+
+        adjacent = any(np.diff(sorted(lines)).min() == 1 for lines in (lines_x, lines_y))
+        assert isinstance(routes, GridRouteTable) != adjacent
+
+        assert_same_routes(routes, getRouteTable(city_roads), city_roads)
+
+def weighted_map(r, blocks=4, block_size=3, one_way=.1):
+    #Regular map with random road costs and a few one-way roads, drawn
+    # again until every road can reach every other
+    while(True):
+        city_map = makeGridMap(blocks, block_size).astype(np.int32)
+        road = city_map == ROAD
+        ways = np.where(np.array([r.random() < one_way for _ in range(road.size)]).reshape(road.shape),
+                        np.array([r.randint(1, 4) for _ in range(road.size)]).reshape(road.shape), 0)
+        costs = np.array([r.randint(1, 9) for _ in range(road.size)]).reshape(road.shape)
+        city_map[road] = (costs * 10 + ways)[road]
+
+        try:
+            return city_map.astype(np.uint8), getRoads(city_map.astype(np.uint8), len(city_map), len(city_map), "table")
+        except ValueError:
+            continue
+
+def assert_same_as_networkx(networkx, city_roads, routes):
+    graph = networkx.DiGraph()
+    for pos, neighbors in city_roads.items():
+        for neighbor in neighbors:
+            if(routes.cost(neighbor) != CLOSED):
+                graph.add_edge(pos, neighbor, weight=routes.cost(neighbor))
+
+    lengths = dict(networkx.all_pairs_dijkstra_path_length(graph))
+    for pos1 in city_roads.keys():
+        for pos2 in city_roads.keys():
+            expected = lengths.get(pos1, {}).get(pos2, -1)
+            assert routes.distance(pos1, pos2) == expected, (pos1, pos2)
+
+            if(expected > 0):
+                next_pos = routes.next_pos(pos1, pos2)
+                assert next_pos in city_roads[pos1]
+                assert routes.cost(next_pos) + lengths[next_pos][pos2] == expected
+
+def test_weighted_one_way_routes_match_networkx():
+    networkx = pytest.importorskip("networkx")
+    r = random.Random(0)
+
+    _, (city_roads, _, _, routes) = weighted_map(r)
+    assert_same_as_networkx(networkx, city_roads, routes)
+
+    #Costs changed at runtime, closed roads included
+    cells = list(city_roads.keys())
+    for _ in range(40):
+        routes.set_cost(r.choice(cells), r.choice([CLOSED, 1, 3, 9]))
+    assert_same_as_networkx(networkx, city_roads, routes)
+
+def test_disconnected_one_way_map_is_rejected():
+    #A single road with one cell that can only be driven one way
+    city_map = np.full((5, 5), BLOCK, dtype=np.uint8)
+    city_map[2] = ROAD
+    city_map[2, 2] = 11
+
+    with pytest.raises(ValueError):
+        getRoads(city_map, 5, 5)
+
+@pytest.mark.parametrize("routing", ["table", "lazy", "grid"])
+def test_disconnected_two_way_map_is_rejected(routing):
+    #Two roads apart
+    city_map = np.full((5, 5), BLOCK, dtype=np.uint8)
+    city_map[0] = ROAD
+    city_map[4] = ROAD
+
+    with pytest.raises(ValueError):
+        getRoads(city_map, 5, 5, routing)
+
+def test_next_pos_raises_on_unreachable_pairs():
+    city_map = makeGridMap(2, 2)
+    city_roads, _, _, routes = getRoads(city_map, len(city_map), len(city_map))
+    routes.set_cost((0, 0), CLOSED)
+
+    with pytest.raises(ValueError):
+        routes.next_pos((4, 0), (0, 0))
+
+def test_segment_raises_on_unreachable_pairs():
+    #Two roads apart: cells of one road cannot reach the other
+    city_roads = {(x, y): {(x, y + dy) for dy in (-1, 1) if 0 <= y + dy < 5} for x in (0, 4) for y in range(5)}
+
+    for routes in (getRouteTable(city_roads), LazyRouteTable(city_roads)):
+        assert routes.segment((0, 0), (0, 4)) == [(0, 1), (0, 2), (0, 3), (0, 4)]
+
+        with pytest.raises(ValueError):
+            routes.segment((0, 0), (4, 0))
+
+def assert_same_city(loaded, built):
+    city_roads, city_blocks, passenger_blocks, routes = loaded
+    built_roads, built_blocks, built_passenger_blocks, built_routes = built
+
+    assert city_roads == built_roads
+    assert sorted(city_blocks) == sorted(built_blocks)
+    assert passenger_blocks == built_passenger_blocks
+
+    assert routes.cells == built_routes.cells
+    assert np.array_equal(routes.distance_matrix, built_routes.distance_matrix)
+    assert np.array_equal(routes.next_hop, built_routes.next_hop)
+
+def test_cached_routes_match_a_fresh_build(tmp_path):
+    filename = str(tmp_path / "city.npy")
+    cache_dir = str(tmp_path / "cache")
+    city_map = makeGridMap(4, 5)
+    writeCityMap(filename, city_map)
+
+    directory = getCityCache(filename, cache_dir)
+    loaded = loadCity(directory)
+
+    #The table is read straight from the cache files
+    assert isinstance(loaded[3].distance_matrix, np.memmap)
+    assert_same_city(loaded, getRoads(city_map, len(city_map), len(city_map[0])))
+
+    #An unchanged map reuses its entry
+    assert getCityCache(filename, cache_dir) == directory
+    assert os.listdir(cache_dir) == [os.path.basename(directory)]
+
+def test_stale_cache_is_rebuilt(tmp_path, monkeypatch):
+    filename = str(tmp_path / "city.npy")
+    cache_dir = str(tmp_path / "cache")
+    writeCityMap(filename, makeGridMap(4, 5))
+    old = getCityCache(filename, cache_dir)
+
+    #A changed map gets a new entry built from its contents
+    city_map = makeGridMap(3, 6)
+    writeCityMap(filename, city_map)
+    directory = getCityCache(filename, cache_dir)
+
+    assert directory != old
+    assert_same_city(loadCity(directory), getRoads(city_map, len(city_map), len(city_map[0])))
+
+    #So does a cache written by another version of the format
+    monkeypatch.setattr(utils, "ROUTE_CACHE_VERSION", utils.ROUTE_CACHE_VERSION + 1)
+    assert getCityCache(filename, cache_dir) not in (old, directory)
+
+def test_lazy_routes_evict_the_least_recently_used_tree():
+    city_roads, _, _, _ = getRoads(makeGridMap(3, 4), 13, 13)
+    cells = list(city_roads.keys())
+    tree_bytes = 2 * len(cells) * np.dtype(np.int32).itemsize
+    routes = LazyRouteTable(city_roads, max_bytes=3 * tree_bytes)
+    a, b, c, d = (routes.index[pos] for pos in cells[:4])
+
+    for pos in cells[:3]:
+        routes.distance(cells[-1], pos)
+    routes.distance(cells[-1], cells[0])
+    assert (routes.hits, routes.misses) == (1, 3)
+
+    #b is now the least recently used tree
+    routes.distance(cells[-1], cells[3])
+    assert list(routes.trees) == [c, a, d]
+    assert routes.nbytes == 3 * tree_bytes
+
+    routes.distance(cells[-1], cells[1])
+    assert (routes.hits, routes.misses) == (1, 5)
+    assert list(routes.trees) == [a, d, b]
+
+@pytest.mark.parametrize("weighted", [False, True])
+def test_lazy_routes_match_table_while_evicting(weighted):
+    r = random.Random(0)
+    city_map = makeGridMap(3, 4)
+    if(weighted):
+        city_map = city_map.astype(np.int32)
+        road = city_map == ROAD
+        city_map[road] = [10 * r.randint(1, 4) for _ in range(road.sum())]
+    city_roads, _, _, table = getRoads(city_map, 13, 13)
+    costs = {pos: table.cost(pos) for pos in table.keys()} if weighted else None
+
+    #Room for two trees only, so most queries rebuild one
+    routes = LazyRouteTable(city_roads, costs, max_bytes=2 * 2 * len(city_roads) * np.dtype(np.int32).itemsize)
+    pairs = [(pos1, pos2) for pos1 in table.keys() for pos2 in table.keys()]
+    r.shuffle(pairs)
+
+    for pos1, pos2 in pairs:
+        assert routes.distance(pos1, pos2) == table.distance(pos1, pos2), (pos1, pos2)
+    assert routes.misses > len(table.keys())
+    assert len(routes.trees) == 2
+
+    if(not weighted):
+        assert_same_routes(routes, table, city_roads)
+
+def test_routes_without_costs_refuse_changes():
+    city_map = grid_map(9, [0, 4, 8], [0, 4, 8])
+    _, _, _, routes = getRoads(city_map, 9, 9, "grid")
+
+    assert isinstance(routes, GridRouteTable) and not routes.supports_costs
+    with pytest.raises(NotImplementedError, match="changing road costs"):
+        routes.set_cost((0, 0), 2)
+    with pytest.raises(NotImplementedError, match="copying"):
+        routes.copy()
+    with pytest.raises(TypeError):
+        Routes()
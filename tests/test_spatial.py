@@ -0,0 +1,34 @@
+import pytest
+
+from soas_project.agents import Passenger
+from soas_project.model import CityModel
+from soas_project.utils import getRoads, makeGridMap
+
+def grid_scan(model, pos, radius):
+    #How the cabs sighted passengers before the SightingTable
+    neighbors = model.grid.get_neighbors(pos, True, include_center=False, radius=radius)
+
+    return [obj for obj in neighbors if isinstance(obj, Passenger)]
+
+@pytest.mark.parametrize("radius", [1, 2])
+def test_sightings_match_the_grid_scan(radius):
+    city_map = makeGridMap(4, 5)
+    size = len(city_map)
+    city_roads, city_blocks, passenger_blocks, routes = getRoads(city_map, size, size)
+    model = CityModel(PassengerBlocks=passenger_blocks, width=size, height=size, city_map=city_map,
+                      roads=city_roads, city_blocks=city_blocks, routes=routes, N=8, PassengerPopulation=.3,
+                      SightingRadius=radius, seed=0)
+
+    added = set()
+    removed = 0
+    for _ in range(100):
+        before = set(model.passengers)
+        model.step()
+        added |= set(model.passengers) - before
+        removed += len(before - set(model.passengers))
+
+        for pos in model.roads:
+            assert model.sightings.around(pos) == grid_scan(model, pos, radius), pos
+
+    #Passengers came and went during the run
+    assert len(added) > 0 and removed > 0